@@ -0,0 +1,153 @@
+import os
+import io
+import json
+import time
+import gzip
+import random
+import hashlib
+import threading
+import logging
+import lru
+from typing import Any, Dict, List, Optional, Set
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class PageArchive():
+    """
+    デバッグ用に取得したページを保存しておく容量・期間に上限のある保存先
+
+    ページは中身のハッシュをファイル名にして圧縮して保存するので、
+    レーティング更新待ちのように同じページを何度も取得しても1つしか保存されない。
+    いつどのURLでどのページを取得したかは`index.jsonl`に記録する。
+    新しいページを保存したときに、`max_age`秒より古いものと、合計が`max_size`バイトを超えた分を古い順に消す。
+    `index.jsonl`は同じページを保存したときも含めて毎回、`max_age`秒より古い記録があれば消して詰める。
+    """
+
+    def __init__(self,
+                 path: str = 'log/pages',
+                 max_size: int = 100 * 1024 * 1024,
+                 max_age: float = 60 * 60 * 24 * 7,
+                 sample_rate: float = 1.0,
+                 compression: str = 'gzip') -> None:
+        """
+            :param path: 保存先のディレクトリ
+            :param max_size: 保存するページの合計サイズの上限（圧縮後のバイト数）
+            :param max_age: ページを残しておく秒数
+            :param sample_rate: ページを保存する確率（0なら保存しない）
+            :param compression: `gzip`か`zstd`（`zstandard`が無ければgzipになる）
+        """
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.sample_rate = sample_rate
+        self.compression = compression
+        if compression == 'zstd':
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                logger.warning('zstandard is not installed, use gzip instead')
+                self.compression = 'gzip'
+        self._lock = threading.Lock()
+        # `index.jsonl`の最も古い記録の時刻（記録は時刻順に追記されるので、これが期限内なら詰める必要はない）
+        self._index_oldest: Optional[float] = None
+
+    def _blobPath(self, digest: str, compression: str) -> str:
+        return os.path.join(self.path, digest[:2], digest + '.html.' + ('zst' if compression == 'zstd' else 'gz'))
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.compression == 'zstd':
+            import zstandard
+            return zstandard.ZstdCompressor().compress(data)
+        return gzip.compress(data)
+
+    def save(self, url: str, page: str) -> Optional[str]:
+        """
+        ページを保存する（サンプリングで保存しなかった場合はNone）
+            :param url: ページのURL
+            :param page: ページの中身
+            :return: ページのハッシュ
+        """
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        data = page.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self._blobPath(digest, self.compression)
+        with self._lock:
+            is_new = not os.path.exists(blob_path)
+            if is_new:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                tmp_path = blob_path + '.tmp'
+                with open(tmp_path, 'wb') as fh:
+                    fh.write(self._compress(data))
+                os.replace(tmp_path, blob_path)
+            else:
+                lru.touch(blob_path)
+            now = time.time()
+            with io.open(os.path.join(self.path, 'index.jsonl'), 'a', encoding='utf-8') as fh:
+                fh.write(json.dumps({'time': now, 'url': url, 'digest': digest, 'size': len(data)}) + '\n')
+            if is_new:
+                self._evict()
+            elif self._index_oldest is None or self._index_oldest < now - self.max_age:
+                # 同じページの取得が続いても一覧は伸び続けないようにする（プロセスで最初の保存では一覧を読んで確かめる）
+                self._trimIndex(set())
+        return digest
+
+    def load(self, digest: str) -> Optional[str]:
+        """保存したページを返す（消されていればNone）"""
+        for compression in ['gzip', 'zstd']:
+            blob_path = self._blobPath(digest, compression)
+            if not os.path.exists(blob_path):
+                continue
+            with open(blob_path, 'rb') as fh:
+                data = fh.read()
+            if compression == 'zstd':
+                import zstandard
+                return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+            return gzip.decompress(data).decode('utf-8')
+        return None
+
+    def readIndex(self) -> List[Dict[str, Any]]:
+        """保存したページの一覧（古い順、消されたページも含む）"""
+        index_path = os.path.join(self.path, 'index.jsonl')
+        if not os.path.exists(index_path):
+            return []
+        with io.open(index_path, encoding='utf-8') as fh:
+            return [json.loads(line) for line in fh if line.strip()]
+
+    def _evict(self) -> None:
+        removed_list, _ = lru.evict(self.path, ['.gz', '.zst'], self.max_size, self.max_age)
+        removed = set(os.path.basename(blob_path).split('.')[0] for blob_path in removed_list)
+        if removed:
+            logger.info('evict %d pages from archive' % len(removed))
+        self._trimIndex(removed)
+
+    def _trimIndex(self, removed: Set[str]) -> None:
+        """
+        消したページと`max_age`秒より古い記録を一覧から消す
+            :param removed: 消したページのハッシュ
+        """
+        expire = time.time() - self.max_age
+        all_entry_list = self.readIndex()
+        entry_list = [
+            entry for entry in all_entry_list
+            if entry['digest'] not in removed and entry['time'] >= expire
+        ]
+        self._index_oldest = entry_list[0]['time'] if entry_list else None
+        if len(entry_list) == len(all_entry_list):
+            return
+        index_path = os.path.join(self.path, 'index.jsonl')
+        with io.open(index_path + '.tmp', 'w', encoding='utf-8') as fh:
+            fh.writelines(json.dumps(entry) + '\n' for entry in entry_list)
+        os.replace(index_path + '.tmp', index_path)
+
+
+def openArchive(config: Any) -> PageArchive:
+    """設定ファイルの`[archive]`からページの保存先を作る"""
+    return PageArchive(
+        path=config.get('archive', 'path', fallback='log/pages'),
+        max_size=int(config.getfloat('archive', 'max_size', fallback=100) * 1024 * 1024),
+        max_age=config.getfloat('archive', 'max_age', fallback=7) * 60 * 60 * 24,
+        sample_rate=config.getfloat('archive', 'sample_rate', fallback=1.0),
+        compression=config.get('archive', 'compression', fallback='gzip'),
+    )
@@ -0,0 +1,83 @@
+"""
+列ごとのレーティング履歴（`ratingstore.RatingStore`）の読み込みとチームの集計の所要時間を合成データで計測する
+    ex: `python3 bench/analytics.py --sizes 100 1000 10000 --contests 1500`
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import datetime as dt
+import numpy as np
+from typing import Callable, List, Tuple
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import generate  # noqa: E402
+import history  # noqa: E402
+import ratingstore  # noqa: E402
+
+
+def makeRatingHistoryList(size: int, contest_count: int, seed: int = 0) -> List[Tuple[str, history.RatingHistory]]:
+    """
+    合成した全ユーザーのレーティング履歴を返す（コンテストは週2回、各ユーザーは一部のコンテストに参加する）
+        :param size: ユーザー数
+        :param contest_count: コンテスト数
+    """
+    rng = np.random.RandomState(seed)
+    date_end = int(dt.datetime.now().timestamp())
+    end_time_list = date_end - np.arange(contest_count)[::-1] * 60 * 60 * 24 * 7 // 2
+    rating_history_list = []
+    for i in range(size):
+        joined = np.flatnonzero(rng.rand(contest_count) < rng.uniform(0.05, 0.5))
+        rating = np.maximum(0, np.cumsum(rng.randint(-80, 100, len(joined))))
+        rating_history_list.append(('user%d' % i, [
+            {'EndTime': int(end_time_list[c]), 'NewRating': int(r), 'Place': int(rng.randint(1, 10000)),
+             'ContestName': 'contest%d' % c}
+            for c, r in zip(joined, rating)
+        ]))
+    return rating_history_list
+
+
+def measure(f: Callable[[], object], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(size_list: List[int], contest_count: int, team_size: int, repeat: int) -> None:
+    print('%8s %10s %12s %12s %12s %12s %12s %12s' % (
+        'users', 'rows', 'open[ms]', 'average[ms]', 'pctl[ms]', 'movers[ms]', 'streaks[ms]', 'summary[ms]'))
+    for size in size_list:
+        path = tempfile.mkdtemp()
+        try:
+            store = ratingstore.RatingStore(path)
+            store.update(makeRatingHistoryList(size, contest_count))
+            store.save()
+            open_store = measure(lambda: ratingstore.RatingStore(path), repeat)
+            store = ratingstore.RatingStore(path)
+            team = store.user_names[::max(1, size // team_size)]
+            since = dt.datetime.now().timestamp() - 60 * 60 * 24
+            average = measure(lambda: store.averageTimeline(team), repeat)
+            percentile = measure(lambda: store.percentiles(team, [25, 50, 75]), repeat)
+            movers = measure(lambda: store.biggestMovers(team, since), repeat)
+            streaks = measure(lambda: store.streaks(team), repeat)
+            summary = measure(lambda: generate.generateTeamSummary(store, team, since), repeat)
+            print('%8d %10d %12.2f %12.2f %12.2f %12.2f %12.2f %12.2f' % (
+                size, len(store), open_store * 1000, average * 1000, percentile * 1000, movers * 1000,
+                streaks * 1000, summary * 1000))
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000])
+    parser.add_argument('--contests', type=int, default=1500, help='number of contests (about 10 years)')
+    parser.add_argument('--team', type=int, default=100, help='number of team members to summarize')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    generate.logger.setLevel('WARNING')
+    main(args.sizes, args.contests, args.team, args.repeat)
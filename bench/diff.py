@@ -0,0 +1,91 @@
+"""
+レート対象者の選択・レーティング更新チェック・前後の差分計算の所要時間を合成データで計測する
+    ex: `python3 bench/diff.py --sizes 10 100 1000 10000`
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List, Tuple
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import generate  # noqa: E402
+
+COLORS = ['gray', 'brown', 'green', 'cyan', 'blue', 'yellow', 'orange', 'red']
+
+
+def makeUserList(size: int, seed: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    合成したコンテスト前後の所属ユーザーデータを返す
+        :param size: 所属ユーザー数
+        :return: (コンテスト前, コンテスト後)
+    """
+    rng = np.random.RandomState(seed)
+    rating = rng.randint(0, 3200, size)
+    count = rng.randint(1, 100, size)
+    pre_user_list = pd.DataFrame({
+        'name': ['user%d' % i for i in range(size)],
+        'color': [COLORS[r // 400] for r in rating],
+        'rating': rating,
+        'count': count,
+    }).sort_values('rating', ascending=False)
+    pre_user_list['rank'] = list(range(1, size + 1))
+
+    played = rng.rand(size) < 0.3
+    current_user_list = pre_user_list.copy()
+    current_user_list['rating'] = np.maximum(0, current_user_list['rating'] + played * rng.randint(-100, 100, size))
+    current_user_list['count'] = current_user_list['count'] + played
+    current_user_list = current_user_list.sort_values('rating', ascending=False)
+    current_user_list['rank'] = list(range(1, size + 1))
+    # 新しく所属に入ったユーザー
+    pre_user_list = pre_user_list.iloc[:-max(1, size // 100)]
+    return pre_user_list, current_user_list
+
+
+def makeContestStatistics(user_list: pd.DataFrame, seed: int = 0) -> Dict[str, pd.DataFrame]:
+    rng = np.random.RandomState(seed)
+    participant = user_list.sample(frac=0.3, random_state=seed)
+    result = pd.DataFrame({
+        'rank': list(range(1, len(participant) + 1)),
+        'global_rank': sorted(rng.randint(1, 10000, len(participant))),
+        'name': list(participant['name']),
+        'score': [str(s) for s in rng.randint(0, 2000, len(participant))],
+        'isJoin': rng.rand(len(participant)) < 0.9,
+    })
+    points = pd.DataFrame({p: rng.rand(len(participant)) < 0.5 for p in 'ABCD'})
+    return {'result': result, 'points': points}
+
+
+def measure(f: Callable[[], object], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(size_list: List[int], repeat: int) -> None:
+    contest_list = pd.DataFrame({'id': ['/contests/abc', '/contests/arc'], 'rating_limit': [1199, 2799]})
+    print('%8s %12s %12s %12s' % ('users', 'select[ms]', 'check[ms]', 'diff[ms]'))
+    for size in size_list:
+        pre_user_list, current_user_list = makeUserList(size)
+        contest_statistics_list = [makeContestStatistics(current_user_list, seed) for seed in range(2)]
+        target_user_name_list = generate.selectRateTargetUserList(
+            contest_list, contest_statistics_list, pre_user_list)
+        select = measure(lambda: generate.selectRateTargetUserList(
+            contest_list, contest_statistics_list, pre_user_list), repeat)
+        check = measure(lambda: generate.checkRatingUpdate(
+            target_user_name_list, current_user_list, pre_user_list), repeat)
+        diff = measure(lambda: generate.diffUserList(current_user_list, pre_user_list), repeat)
+        print('%8d %12.2f %12.2f %12.2f' % (size, select * 1000, check * 1000, diff * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    generate.logger.setLevel('WARNING')
+    main(args.sizes, args.repeat)
@@ -0,0 +1,327 @@
+"""
+ネットワークを使わずにパース・差分計算・描画・`generate.py`全体の所要時間を計測する
+    ex: `python3 bench/offline.py --sizes 10 100 1000`
+
+所属ユーザー数ごとに合成したAtCoderのページ（順位表のJSON・ランキング・ユーザーページ）を
+`tmp/bench/fixtures/(ユーザー数)`に書き出し、`bench/standin.py`のサーバーから返す。
+記録した本物のページも同じ配置で置けば`bench/standin.py`から返せる。
+`generate.py`全体の計測はレーティング履歴のキャッシュが無い場合（cold）とある場合（warm）の2回行い、
+段階ごとの内訳は`[metrics]`のトレースから取り出す。
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import configparser
+import datetime as dt
+import jinja2
+import numpy as np
+import pandas as pd
+from typing import Any, Callable, Dict, List
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCH_PATH, '..'))
+sys.path.append(BENCH_PATH)
+import generate  # noqa: E402
+import render  # noqa: E402
+import storage  # noqa: E402
+import util  # noqa: E402
+import viewmodel  # noqa: E402
+from diff import makeUserList  # noqa: E402
+from standin import StandInServer  # noqa: E402
+
+# 設定の所属は`config-sample.ini`と同じくワイルドカードで書く
+AFFILIATION = '*bench-club*'
+MEMBER_AFFILIATION = 'Tokyo bench-club'
+CONTEST_ID = '/contests/bench'
+TASK_LIST = ['A', 'B', 'C', 'D', 'E', 'F']
+WORK_PATH = 'tmp/bench'
+
+
+def writeFile(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with io.open(path, 'w', encoding='utf-8') as fh:
+        fh.write(content)
+
+
+def makeStandingsJson(pre_user_list: pd.DataFrame, current_user_list: pd.DataFrame, seed: int = 0) -> str:
+    """コンテストに参加した所属ユーザー（`count`が増えたユーザー）と、その数倍の所属外のユーザーの順位表"""
+    rng = np.random.RandomState(seed)
+    pre_count = pre_user_list.set_index('name')['count']
+    played = current_user_list[current_user_list['count'] != current_user_list['name'].map(pre_count)]
+    name_list = list(played['name']) + ['other%d' % i for i in range(len(played) * 3)]
+    affiliation_list = [MEMBER_AFFILIATION] * len(played) + ['other'] * (len(name_list) - len(played))
+    order = rng.permutation(len(name_list))
+
+    def taskResults() -> Dict[str, Any]:
+        return {
+            'bench_' + task.lower(): {'Score': int(rng.randint(1, 6)) * 10000, 'Count': 1, 'Penalty': 0, 'Elapsed': 0}
+            for task in TASK_LIST if rng.rand() < 0.5
+        } or {'bench_a': {'Score': 0, 'Count': 1, 'Penalty': 1, 'Elapsed': 0}}
+
+    standings_data = []
+    for rank, i in enumerate(order):
+        task_results = taskResults()
+        standings_data.append({
+            'Rank': rank + 1,
+            'UserScreenName': name_list[i],
+            'Affiliation': affiliation_list[i],
+            'TotalResult': {'Score': sum(r['Score'] for r in task_results.values()), 'Count': len(task_results),
+                            'Penalty': 0, 'Elapsed': 0},
+            'TaskResults': task_results,
+        })
+    return json.dumps({
+        'TaskInfo': [
+            {'Assignment': task, 'TaskName': 'Task ' + task, 'TaskScreenName': 'bench_' + task.lower()}
+            for task in TASK_LIST
+        ],
+        'StandingsData': standings_data,
+    })
+
+
+def makeRankingPage(user_list: pd.DataFrame) -> str:
+    """ランキングページ（2つ目の表がランキング）"""
+    row_list = ''.join(
+        '<tr><td>%d</td><td><a href="/users/%s" class="username"><span class="user-%s">%s</span></a></td>'
+        '<td>%d</td><td>%d</td></tr>' % (user['rank'], user['name'], user['color'], user['name'],
+                                         user['rating'], user['count'])
+        for i, user in user_list.iterrows())
+    return ('<html><body><table><tr><th>Affiliation</th></tr><tr><td>%s</td></tr></table>'
+            '<table><thead><tr><th>Rank</th><th>User</th><th>Rating</th><th>Match</th></tr></thead>'
+            '<tbody>%s</tbody></table></body></html>' % (AFFILIATION, row_list))
+
+
+def makeUserPage(rating: int, count: int, rng: np.random.RandomState) -> str:
+    """`rating_history`を埋め込んだユーザーページ"""
+    date_begin, date_end = 1521540800, int(dt.datetime.now().timestamp())
+    end_time_list = sorted(rng.randint(date_begin, date_end, count))
+    rating_list = np.maximum(0, rating + np.cumsum(rng.randint(-100, 100, count))[::-1] - rng.randint(-100, 100))
+    rating_list[-1] = rating
+    rating_history = [
+        {'EndTime': int(end_time), 'NewRating': int(new_rating), 'OldRating': 0, 'Place': 1,
+         'ContestName': 'bench', 'StandingsUrl': CONTEST_ID + '/standings'}
+        for end_time, new_rating in zip(end_time_list, rating_list)
+    ]
+    return ('<html><body><div id="main-container"><div><div></div><div></div><div><div>'
+            '<script>var x=0;</script><script>var rating_history=%s;</script>'
+            '</div></div></div></div></body></html>' % json.dumps(rating_history))
+
+
+def makeFixtures(fixture_dir: str, pre_user_list: pd.DataFrame, current_user_list: pd.DataFrame) -> None:
+    rng = np.random.RandomState(0)
+    writeFile(os.path.join(fixture_dir, CONTEST_ID.lstrip('/'), 'standings', 'json'),
+              makeStandingsJson(pre_user_list, current_user_list))
+    writeFile(os.path.join(fixture_dir, 'ranking'), makeRankingPage(current_user_list))
+    for i, user in current_user_list.iterrows():
+        writeFile(os.path.join(fixture_dir, 'users', user['name']),
+                  makeUserPage(int(user['rating']), int(user['count']), rng))
+
+
+def makeDataDir(data_path: str, pre_user_list: pd.DataFrame, keep_history: bool) -> None:
+    """コンテストとコンテスト前のユーザーデータだけが入ったDBを作る"""
+    history_path = os.path.join(data_path, 'rating_history.json')
+    saved_history = None
+    if keep_history and os.path.exists(history_path):
+        with io.open(history_path, encoding='utf-8') as fh:
+            saved_history = fh.read()
+    shutil.rmtree(data_path, ignore_errors=True)
+    os.makedirs(data_path)
+    if saved_history is not None:
+        writeFile(history_path, saved_history)
+    db = storage.Storage(os.path.join(data_path, 'atcoder.sqlite3'))
+    date = dt.datetime.now() - dt.timedelta(hours=2)
+    db.appendContestList(pd.DataFrame([{
+        'id': CONTEST_ID, 'date': date, 'title': 'Bench Contest', 'link': CONTEST_ID,
+        'time': dt.timedelta(hours=1, minutes=40), 'finish_date': date + dt.timedelta(hours=1, minutes=40),
+        'is_rating': True, 'rating_limit': 9999,
+    }]))
+    db.appendUserList(pre_user_list)
+    db.close()
+
+
+def makeConfig(path: str, server: StandInServer, trace_path: str) -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    # フォントなどは本番の設定を使う
+    config.read('config.ini')
+    for section in ['atcoder', 'slack', 'render', 'metrics']:
+        if not config.has_section(section):
+            config.add_section(section)
+    config['atcoder'].update({
+        'affiliation': AFFILIATION, 'standings_backend': 'json', 'base_url': server.url, 'session': ''})
+    config['slack'].update({
+        'channel_name': 'bench', 'test_channel_name': 'bench', 'token': 'xoxb-bench',
+        'api_url': server.url + '/slack/'})
+    config['metrics']['path'] = trace_path
+    config['render_cache'] = {'path': os.path.join(os.path.dirname(path), 'render_cache')}
+    with io.open(path, 'w', encoding='utf-8') as fh:
+        config.write(fh)
+    return config
+
+
+def measure(f: Callable[[], object], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def readLastSummary(trace_path: str) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {}
+    with io.open(trace_path, encoding='utf-8') as fh:
+        for line in fh:
+            event = json.loads(line)
+            if event['event'] == 'summary':
+                summary = event
+    return summary
+
+
+def benchSize(size: int, repeat: int) -> Dict[str, Any]:
+    work_path = os.path.join(WORK_PATH, str(size))
+    fixture_dir = os.path.join(WORK_PATH, 'fixtures', str(size))
+    pre_user_list, current_user_list = makeUserList(size)
+    makeFixtures(fixture_dir, pre_user_list, current_user_list)
+
+    server = StandInServer(fixture_dir).start()
+    try:
+        trace_path = os.path.join(work_path, 'trace.jsonl')
+        config_path = os.path.join(work_path, 'config.ini')
+        os.makedirs(work_path, exist_ok=True)
+        if os.path.exists(trace_path):
+            os.remove(trace_path)
+        generate.config = makeConfig(config_path, server, trace_path)
+        render.setFont(generate.config.get('render', 'font_path', fallback=None),
+                       generate.config.get('render', 'bold_font_path', fallback=None))
+
+        # パース
+        standings_page = util.fetch(server.url + CONTEST_ID + '/standings/json')
+        ranking_page = util.fetch(server.url + '/ranking')
+        user_page_list = util.fetchAll([server.url + '/users/' + name for name in current_user_list['name']])
+        parse_standings = measure(lambda: generate.parseStandingsJson(standings_page, AFFILIATION), repeat)
+        def parseRanking() -> None:
+            # パース結果のキャッシュが効かないように毎回消す
+            util._parsed_table_cache.clear()
+            generate.fetchUserList(AFFILIATION, ranking_page)
+        parse_ranking = measure(parseRanking, repeat)
+        parse_history = measure(lambda: [
+            generate.parseRatingHistory(util.parseXpath(
+                page, '//*[@id="main-container"]/div[1]/div[3]/div/script[2]/text()')[0][4:-1])
+            for page in user_page_list], 1)
+
+        # 差分計算
+        contest_list = pd.DataFrame({'id': [CONTEST_ID], 'rating_limit': [9999]})
+        contest_statistics_list = [generate.parseStandingsJson(standings_page, AFFILIATION)]
+        assert not contest_statistics_list[0]['result'].empty, 'no member matched ' + AFFILIATION
+        user_list = generate.fetchUserList(AFFILIATION, ranking_page)
+        diff = measure(lambda: (
+            generate.checkRatingUpdate(
+                generate.selectRateTargetUserList(contest_list, contest_statistics_list, pre_user_list),
+                user_list, pre_user_list),
+            generate.diffUserList(user_list, pre_user_list)), repeat)
+
+        # 描画
+        contest_title_list = pd.DataFrame({'title': ['Bench Contest'], 'link': [CONTEST_ID]})
+        rating_user_list = generate.diffUserList(user_list, pre_user_list)
+        user_chart_list = [
+            (name, generate.parseRatingHistory(util.parseXpath(
+                page, '//*[@id="main-container"]/div[1]/div[3]/div/script[2]/text()')[0][4:-1]))
+            for name, page in zip(current_user_list['name'], user_page_list)
+        ]
+        date_begin, date_end = 1521540800, int(dt.datetime.now().timestamp()) + 1000000
+        chart_range_list = [render.ChartRange(date_begin, date_end, 1200, 2800),
+                            render.ChartRange(date_begin, date_end, 0, 1200)]
+        render_result = measure(lambda: render.renderResult(viewmodel.buildResultTableList(
+            contest_title_list, contest_statistics_list, user_list)), 1)
+        render_rating = measure(lambda: render.renderRating(viewmodel.buildRatingRowList(rating_user_list)), 1)
+        # chromeで描画する場合のHTMLの生成（ブラウザは含まない）
+        template = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(searchpath=os.path.join(BENCH_PATH, '..', 'tpl'), encoding='utf8'),
+        ).get_template('result.tpl.html')
+        render_html = measure(lambda: template.render({'result_table_list': viewmodel.buildResultTableList(
+            contest_title_list, contest_statistics_list, user_list)}), repeat)
+        render_chart = measure(lambda: render.renderChart(user_chart_list, chart_range_list), 1)
+
+        # `generate.py`全体
+        data_path = os.path.join(work_path, 'data')
+        e2e = {}
+        # retry: 同じデータでの再実行（描画した画像のキャッシュも使う）
+        for run in ['cold', 'warm', 'retry']:
+            makeDataDir(data_path, pre_user_list, keep_history=(run != 'cold'))
+            if run != 'retry':
+                shutil.rmtree(os.path.join(work_path, 'render_cache'), ignore_errors=True)
+            start = time.perf_counter()
+            generate.main([CONTEST_ID], mode='test', config_path=config_path, data_path=data_path)
+            e2e[run] = time.perf_counter() - start
+            if run == 'warm':
+                stages = readLastSummary(trace_path).get('spans', {})
+        stats = server.stats()
+    finally:
+        server.stop()
+
+    return {
+        'size': size,
+        'parse_standings': parse_standings,
+        'parse_ranking': parse_ranking,
+        'parse_history': parse_history,
+        'diff': diff,
+        'render_result': render_result,
+        'render_html': render_html,
+        'render_rating': render_rating,
+        'render_chart': render_chart,
+        'e2e_cold': e2e['cold'],
+        'e2e_warm': e2e['warm'],
+        'e2e_retry': e2e['retry'],
+        'stages': stages,
+        'slack_calls': stats['slack_calls'],
+    }
+
+
+def checkAffiliationFilter() -> None:
+    """順位表のJSONを設定と同じ書き方（ワイルドカード・部分一致）の所属で絞り込めるか確かめる"""
+    standings = json.dumps({'TaskInfo': [{'Assignment': 'A', 'TaskScreenName': 'bench_a'}], 'StandingsData': [
+        {'Rank': rank + 1, 'UserScreenName': name, 'Affiliation': affiliation,
+         'TotalResult': {'Score': 10000}, 'TaskResults': {'bench_a': {'Score': 10000}}}
+        for rank, (name, affiliation) in enumerate([
+            ('member1', MEMBER_AFFILIATION), ('member2', 'bench-club'), ('other1', 'other'), ('other2', None)])
+    ]})
+    for affiliation, expected in [
+            (AFFILIATION, ['member1', 'member2']), ('bench-club', ['member1', 'member2']),
+            ('Tokyo*club', ['member1']), ('*Osaka*', [])]:
+        name_list = list(generate.parseStandingsJson(standings, affiliation)['result']['name'])
+        assert name_list == expected, 'affiliation %s matched %s' % (affiliation, name_list)
+
+
+def main(size_list: List[int], repeat: int) -> None:
+    checkAffiliationFilter()
+    result_list = [benchSize(size, repeat) for size in size_list]
+
+    column_list = ['parse_standings', 'parse_ranking', 'parse_history', 'diff',
+                   'render_result', 'render_html', 'render_rating', 'render_chart', 'e2e_cold', 'e2e_warm',
+                   'e2e_retry']
+    print('%8s' % 'users' + ''.join(' %15s' % column for column in column_list) + '  (ms)')
+    for result in result_list:
+        print('%8d' % result['size'] + ''.join(' %15.1f' % (result[column] * 1000) for column in column_list))
+
+    print()
+    print('stages of e2e_warm (ms)')
+    stage_list = [name for name in result_list[0]['stages']]
+    print('%8s' % 'users' + ''.join(' %19s' % stage for stage in stage_list))
+    for result in result_list:
+        print('%8d' % result['size'] + ''.join(
+            ' %19.1f' % (result['stages'].get(stage, {}).get('total', 0) * 1000) for stage in stage_list))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    # ローカルのサーバーなのでリクエストの間隔を空けず、レーティング更新後の待ち時間も省く
+    util.rate_limiter.interval = 0
+    generate.RATING_SETTLE_WAIT = 0
+    for name in ['generate', 'util', 'slack', 'metrics', 'storage', 'history']:
+        __import__(name).logger.setLevel('WARNING')
+    main(args.sizes, args.repeat)
@@ -0,0 +1,108 @@
+"""
+記録しておいたAtCoderのページを返すローカルのHTTPサーバー（Slack APIの代わりも兼ねる）
+    ex: `python3 bench/standin.py tmp/bench/fixtures/100 --port 8000`
+
+フィクスチャのディレクトリにはURLのパスと同じ場所にページを置く（クエリ文字列は無視する）。
+パスがディレクトリの場合はその中の`index.html`を返す。
+    /contests/abc100/standings/json -> (fixture_dir)/contests/abc100/standings/json
+    /contests?lang=ja               -> (fixture_dir)/contests/index.html
+    /ranking?f.Affiliation=...      -> (fixture_dir)/ranking
+    /users/hogehoge                 -> (fixture_dir)/users/hogehoge
+`/slack/(メソッド名)`へのPOSTは`{"ok": true}`を返し、受け取ったバイト数を数える。
+"""
+import os
+import json
+import argparse
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+
+class StandInServer():
+    """別スレッドで動く`ThreadingHTTPServer`"""
+
+    def __init__(self, fixture_dir: str, port: int = 0) -> None:
+        self.fixture_dir = fixture_dir
+        self.slack_call_list: List[str] = []
+        self.slack_bytes = 0
+        self.atcoder_bytes = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def _reply(self, status: int, body: bytes, content_type: str) -> None:
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                path = server.resolve(self.path)
+                if path is None:
+                    self._reply(404, b'not found', 'text/plain')
+                    return
+                with open(path, 'rb') as fh:
+                    body = fh.read()
+                with server._lock:
+                    server.atcoder_bytes += len(body)
+                self._reply(200, body, 'application/json' if path.endswith('json') else 'text/html; charset=utf-8')
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get('Content-Length', 0))
+                self.rfile.read(length)
+                path = urllib.parse.urlparse(self.path).path
+                if not path.startswith('/slack/'):
+                    self._reply(404, b'not found', 'text/plain')
+                    return
+                with server._lock:
+                    server.slack_call_list.append(path[len('/slack/'):])
+                    server.slack_bytes += length
+                self._reply(200, json.dumps({'ok': True}).encode('utf-8'), 'application/json')
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+
+    def resolve(self, url: str) -> Any:
+        """URLに対応するフィクスチャのファイル（無ければNone）"""
+        path = os.path.normpath(os.path.join(self.fixture_dir, urllib.parse.urlparse(url).path.lstrip('/')))
+        if not path.startswith(os.path.normpath(self.fixture_dir)):
+            return None
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        return path if os.path.isfile(path) else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'atcoder_bytes': self.atcoder_bytes,
+                'slack_calls': list(self.slack_call_list),
+                'slack_bytes': self.slack_bytes,
+            }
+
+    def start(self) -> 'StandInServer':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fixture_dir')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    server = StandInServer(args.fixture_dir, args.port)
+    print('serving %s at %s (atcoder base_url = %s, slack api_url = %s/slack/)' % (
+        args.fixture_dir, server.url, server.url, server.url))
+    server.httpd.serve_forever()
@@ -0,0 +1,71 @@
+"""
+リマインダーの投稿（`sendMessage.py`）の起動にかかる時間を計測し、予算を超えたら失敗する
+
+起動の速さはマシンによって違うので、予算はインタプリタだけの起動時間に対する倍率で指定する。
+    ex: `python3 bench/startup.py --budget 1.5`
+"""
+import os
+import sys
+import argparse
+import subprocess
+import statistics
+import time
+from typing import List
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# `sendMessage.py`が投稿する前に読み込むもの（実行すると投稿してしまうので、読み込みだけを再現する）
+MESSAGE_PATH_CODE = 'import configparser, teams'
+# メッセージを投稿するだけなら読み込まれてはいけないモジュール
+HEAVY_MODULES = ['pandas', 'numpy', 'selenium', 'webdriver_manager', 'lxml', 'PIL', 'IPython', 'jinja2', 'requests']
+
+
+def measure(code: str, repeat: int) -> float:
+    """新しいインタプリタで`code`を実行するのにかかった時間の中央値"""
+    elapsed_list: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', code], cwd=ROOT)
+        elapsed_list.append(time.perf_counter() - start)
+    return statistics.median(elapsed_list)
+
+
+def loadedHeavyModules() -> List[str]:
+    output = subprocess.check_output(
+        [sys.executable, '-c', MESSAGE_PATH_CODE + '; import sys; print("\\n".join(sys.modules))'], cwd=ROOT)
+    loaded = set(output.decode().split())
+    return [module for module in HEAVY_MODULES if module in loaded]
+
+
+def main(budget: float, repeat: int) -> int:
+    """
+        :param budget: 読み込みにかけてよい時間（インタプリタの起動時間の何倍か）
+        :param repeat: 計測する回数
+    """
+    interpreter = measure('pass', repeat)
+    message_path = measure(MESSAGE_PATH_CODE, repeat)
+    overhead = message_path - interpreter
+    print('interpreter  : %7.1f ms' % (interpreter * 1000))
+    print('message path : %7.1f ms (+%.1f ms = %.2fx interpreter, budget %.2fx)' % (
+        message_path * 1000, overhead * 1000, overhead / interpreter, budget))
+
+    failed = False
+    heavy = loadedHeavyModules()
+    if heavy:
+        print('NG: heavy modules are imported on the message path: ' + ', '.join(heavy))
+        failed = True
+    if overhead > budget * interpreter:
+        print('NG: cold start of the message path is over budget')
+        failed = True
+    if not failed:
+        print('OK')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget', type=float, default=1.5,
+                        help='import overhead budget as a multiple of the interpreter start-up time')
+    parser.add_argument('--repeat', type=int, default=7)
+    args = parser.parse_args()
+    sys.exit(main(args.budget, args.repeat))
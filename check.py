@@ -1,83 +1,161 @@
 import pandas as pd
 import datetime as dt
 import os
+import json
 from IPython import embed
 import configparser
-import pickle
 import logging
 import util
+import archive
+import httpcache
+import teams
 import slack
-from typing import Callable
+import storage
+from typing import Callable, List, NamedTuple
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
 
-contest_list_file_path = 'data/contest_list.pickle'
+# `main`で設定する
+config: configparser.ConfigParser
+Slack: slack.Slack
 
+data_path = 'data'
+
+
+class ContestDiff(NamedTuple):
+    """登録済みのコンテストと、コンテスト一覧のページの差分"""
+    added: pd.DataFrame  # 新しく掲載されたコンテスト
+    rescheduled: pd.DataFrame  # 開始時刻などが変わったコンテスト（変わる前の内容）
+    cancelled: pd.DataFrame  # 開始前に掲載されなくなったコンテスト
+
+
+def contestListUrl() -> str:
+    return util.ATCODER_URL + '/contests?lang=ja'
 
-def readContestList() -> pd.DataFrame:
-    if os.path.exists(contest_list_file_path):
-        with open(contest_list_file_path, 'rb') as fh:
-            return pickle.load(fh)
-    else:
-        return pd.DataFrame(
-            columns={'id', 'date', 'title', 'link', 'time', 'finish_date', 'is_rating', 'rating_limit'})
+
+def fetchContestPage(db: storage.Storage) -> httpcache.CachedResponse:
+    """
+    コンテスト一覧のページを条件付きリクエストで取得する
+
+    前回のレスポンスをDBに残しておき、ETag/Last-Modifiedで問い合わせる（変わっていなければ304で済む）。
+        :param db: DB
+        :return: レスポンス（`digest`が前回と同じなら変わっていない）
+    """
+    url = contestListUrl()
+    state = db.readState('contest_page')
+    if state is not None and util.response_cache.get(url) is None:
+        previous = httpcache.CachedResponse(**json.loads(state))
+        if previous.url == url:
+            util.response_cache.put(previous)
+    return util.fetchResponse(url, refresh=True)
 
 
-def fetchContestList() -> pd.DataFrame:
+def fetchContestList(page: str = None) -> pd.DataFrame:
     # サイトには開催中のコンテスト・開催予定のコンテスト・終了したコンテストが掲載されている
     all_raw_contest_list = util.scrapeTable(
-        url='https://beta.atcoder.jp/contests?lang=ja')
+        url=contestListUrl(), page=page)
     if len(all_raw_contest_list) != 3:
         # 予定されているコンテストが一つも無い場合
         return pd.DataFrame(
             columns={'id', 'date', 'title', 'link', 'time', 'finish_date', 'is_rating', 'rating_limit'})
-    raw_contest_list = all_raw_contest_list[1]
+    raw_contest_list = all_raw_contest_list[1].records()
     """
-    返ってくるテーブルの型と例（pandas側の仕様上セルに入っているのはstringなので、すべて`split(',')`して取り出す）
+    返ってくる表の型と例（`util.Cell`のtextsにセル内のテキストが分かれて入っている）
     raw_contest_list = [
       {
-        開始時刻: [
-          (url) 'http://www.timeanddate.com/worldclock/fixedtime.html?iso=20181123T2100&p1=248',
-          ('%Y-%m-%d %H:%M:%S+0900') '2018-11-23 21:00:00+0900'
-        ],
-        コンテスト名: [
-          (link) '/contests/ddcc2019-qual',
-          (string) 'DISCO presents ディスカバリーチャンネル コードコンテスト2019 予選'
-        ],
-        時間: [
-            (h:m) '01:30'
-        ]
-        Rated対象: [
-            (`x` | `All` | `~ a`(a:int)) '~ 1199'
-        ]
+        開始時刻: Cell(
+          texts=[('%Y-%m-%d %H:%M:%S+0900') '2018-11-23 21:00:00+0900'],
+          href=(url) 'http://www.timeanddate.com/worldclock/fixedtime.html?iso=20181123T2100&p1=248'
+        ),
+        コンテスト名: Cell(
+          href=(link) '/contests/ddcc2019-qual',
+          link_text=(string) 'DISCO presents ディスカバリーチャンネル コードコンテスト2019 予選'
+        ),
+        時間: Cell(
+          texts=[(h:m) '01:30']
+        ),
+        Rated対象: Cell(
+          texts=[(`x` | `All` | `~ a`(a:int)) '~ 1199']
+        )
       }
     ]
   """
-    date_list = raw_contest_list['開始時刻'].splitBy(1).map(
-        lambda x: dt.datetime.strptime(x[:-5], '%Y-%m-%d %H:%M:%S')
-    )
-    time_list = raw_contest_list['時間'].splitBy(0).map(
-        lambda x: dt.timedelta() if x == '∞' else dt.timedelta(hours=int(x.split(':')[0]), minutes=int(x.split(':')[1])))
+    date_list = [
+        dt.datetime.strptime(contest['開始時刻'].texts[0][:-5], '%Y-%m-%d %H:%M:%S')
+        for contest in raw_contest_list
+    ]
+    time_list = [
+        dt.timedelta() if x == '∞' else dt.timedelta(hours=int(x.split(':')[0]), minutes=int(x.split(':')[1]))
+        for x in (contest['時間'].texts[0] for contest in raw_contest_list)
+    ]
+    rating_list = [contest['Rated対象'].texts[0] for contest in raw_contest_list]
 
     return pd.DataFrame({
-        'id': raw_contest_list['コンテスト名'].splitBy(0),
+        'id': [contest['コンテスト名'].href for contest in raw_contest_list],
         'date': date_list,
-        'title': raw_contest_list['コンテスト名'].splitBy(1),
-        'link': raw_contest_list['コンテスト名'].splitBy(0),
+        'title': [contest['コンテスト名'].link_text for contest in raw_contest_list],
+        'link': [contest['コンテスト名'].href for contest in raw_contest_list],
         'time': time_list,
         'finish_date': [d + t for d, t in zip(date_list, time_list)],
-        'is_rating': raw_contest_list['Rated対象'].splitBy(0).map(lambda x: x != '×'),
-        'rating_limit': raw_contest_list['Rated対象'].splitBy(0).map(lambda x: -1 if x == '×' else 99999 if x == 'All' else int(x[2:])),
+        'is_rating': [x != '×' for x in rating_list],
+        'rating_limit': [-1 if x == '×' else 99999 if x == 'All' else int(x[2:]) for x in rating_list],
     })
 
 
-def isNew(contest: pd.DataFrame, previous_contest_list: pd.DataFrame) -> bool:
-    return contest['id'] not in previous_contest_list['id'].values
+def diffContestList(registry: pd.DataFrame, fetched_contest_list: pd.DataFrame, now: dt.datetime) -> ContestDiff:
+    """
+    登録済みのコンテストとコンテスト一覧のページを比べる
+        :param registry: 登録済みのコンテスト（`Storage.readContestRegistry`）
+        :param fetched_contest_list: ページに掲載されている開催予定のコンテスト
+        :param now: 現在時刻（これより後に始まるはずのコンテストが掲載されていなければ中止とみなす）
+    """
+    active = registry[registry['status'] != 'cancelled']
+    digest_list = [storage.contestDigest(c) for i, c in fetched_contest_list.iterrows()]
+    fetched_digest = dict(zip(fetched_contest_list['id'], digest_list))
+    is_added = [contest_id not in active.index for contest_id in fetched_contest_list['id']]
+    is_rescheduled = [
+        contest_id in fetched_digest and fetched_digest[contest_id] != digest
+        for contest_id, digest in zip(active.index, active['digest'])
+    ]
+    # 開催予定のコンテストの表が無い場合は、中止かどうか分からないので何もしない
+    is_cancelled = [
+        not fetched_contest_list.empty and contest_id not in fetched_digest and date > now
+        for contest_id, date in zip(active.index, active['date'])
+    ]
+    return ContestDiff(
+        added=fetched_contest_list[is_added],
+        rescheduled=active[is_rescheduled],
+        cancelled=active[is_cancelled],
+    )
+
+
+def isDue(contest_list: pd.DataFrame, now: dt.datetime) -> pd.Series:
+    """リマインダーを登録するコンテスト（開始まで一日を切っていて、まだ終わっていない）"""
+    return (contest_list['date'] - now < dt.timedelta(days=1)) & (contest_list['finish_date'] > now)
 
 
-def hasHeldToday(contest: pd.DataFrame) -> bool:
-    return (contest['date'] - dt.datetime.now()) < dt.timedelta(days=1)
+def useSchedulerDaemon() -> bool:
+    return config.get('scheduler', 'backend', fallback='at') == 'daemon'
 
 
-def setContestReminder(new_contest_list: pd.DataFrame) -> None:
+def scheduleMessage(db: storage.Storage, date: dt.datetime, text: str, contest_id_list: List[str]) -> None:
+    if useSchedulerDaemon():
+        # 開始時刻が変わったときに取り消せるように、どのコンテストのリマインダーかも残しておく
+        db.appendJob(date, 'message', {'text': text, 'contest_id_list': contest_id_list})
+    else:
+        Slack.setReminder(date, text)
+
+
+def scheduleGenerate(db: storage.Storage, date: dt.datetime, contest_id_list: List[str]) -> None:
+    if useSchedulerDaemon():
+        db.appendJob(date, 'generate', {'contest_id_list': contest_id_list})
+    else:
+        util.setReminder(
+            date,
+            'cd ' + os.getcwd() + ' && python3 generate.py ' + ' '.join(contest_id_list) + ' >> log/generate.log 2>&1')
+
+
+def setContestReminder(new_contest_list: pd.DataFrame, db: storage.Storage) -> None:
 
     # 12時間前の通知と15分前通知の登録
     for i, contests in new_contest_list.groupby('date').__iter__():
@@ -85,53 +163,113 @@ def setContestReminder(new_contest_list: pd.DataFrame) -> None:
             '<https://beta.atcoder.jp' + c['link'] + '|' + c['title'] + ('' if c['is_rating'] else '（レート変動なし）') + '>'
             for i, c in contests.iterrows()
         ]
-        Slack.setReminder(
+        scheduleMessage(
+            db,
             contests.iloc[0]['date'] - dt.timedelta(hours=12),
-            '今日の' + contests.iloc[0]['date'].strftime('%H:%M') + 'から ' + '・'.join(contests_link_str_list) + ' が行われます'
+            '今日の' + contests.iloc[0]['date'].strftime('%H:%M') + 'から ' + '・'.join(contests_link_str_list) + ' が行われます',
+            list(contests['id'])
         )
-        Slack.setReminder(
+        scheduleMessage(
+            db,
             contests.iloc[0]['date'] - dt.timedelta(minutes=15),
-            '開始15分前です'
+            '開始15分前です',
+            list(contests['id'])
         )
 
     # コンテスト結果通知の登録
     for i, contests in new_contest_list.groupby('finish_date').__iter__():
         contest_id_list = [c['id'] for i, c in contests.iterrows()]
-        util.setReminder(
-            contests.iloc[0]['finish_date'] + dt.timedelta(seconds=30),
-            'cd ' + os.getcwd() + ' && python3 generate.py ' + ' '.join(contest_id_list) + ' >> log/generate.log 2>&1')
+        scheduleGenerate(db, contests.iloc[0]['finish_date'] + dt.timedelta(seconds=30), contest_id_list)
 
 
-if __name__ == '__main__':
-    logging.basicConfig()
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.INFO)
+def replanContestReminder(db: storage.Storage,
+                          registry: pd.DataFrame,
+                          changed_contest_list: pd.DataFrame) -> List[str]:
+    """
+    開始時刻などが変わったり中止になったりしたコンテストのリマインダーを取り消し、登録し直せるようにする
+
+    リマインダーは同じ時刻のコンテストをまとめて1つにしているので、同じ時刻だったコンテストのリマインダーも登録し直す。
+    `at`で登録したリマインダーは取り消せないので、登録し直すと二重に投稿されてしまう。そのため登録済みのままにする。
+        :param db: DB
+        :param registry: 登録済みのコンテスト（変わる前の内容）
+        :param changed_contest_list: 変わったコンテスト（変わる前の内容）
+        :return: リマインダーを取り消せなかったので登録し直さないコンテストのid
+    """
+    planned = registry[registry['status'] == 'planned']
+    changed_planned = planned[planned.index.isin(changed_contest_list.index)]
+    if changed_planned.empty:
+        return []
+    if not useSchedulerDaemon():
+        logger.warning('Reminders set by `at` cannot be cancelled and are not re-planned, fix them by `atrm` and `at` : ' +
+                       ', '.join(changed_planned.index))
+        return list(changed_planned.index)
+    sibling_list = planned[planned['date'].isin(changed_planned['date']) |
+                           planned['finish_date'].isin(changed_planned['finish_date'])]
+    logger.info('Cancel %d jobs of %s' % (
+        db.cancelJobList(list(sibling_list.index)), ', '.join(sibling_list.index)))
+    # 中止になったもの以外は`upcoming`に戻し、この後リマインダーを登録し直す
+    db.updateContestStatus(list(sibling_list.index), 'upcoming')
+    return []
+
+
+def main() -> None:
+    """コンテスト一覧の変化をDBに反映し、開催が近づいたコンテストのリマインダーと結果通知を予約する"""
+    global config, Slack
 
     config = configparser.ConfigParser()
     config.read('config.ini')
+    util.ATCODER_URL = config.get('atcoder', 'base_url', fallback=util.ATCODER_URL)
+    util.page_archive = archive.openArchive(config)
+    util.response_cache = httpcache.openResponseCache(config)
 
-    Slack = slack.Slack(
-        channel=config['slack']['channel_name'],
-        token=config['slack']['token']
-    )
+    # リマインダーは`sendMessage.py`が全チームのチャンネルに投稿するので、ここではどのチームのものでもよい
+    Slack = teams.openSlackList(config)[0]
 
-    logger.info('Read previous contest list')
-    registered_contest_list = readContestList()
+    db = storage.openStorage(data_path)
+    now = dt.datetime.now()
 
     logger.info('Fetch current contest list')
-    fetched_contest_list = fetchContestList()
+    response = fetchContestPage(db)
+    previous_digest = json.loads(db.readState('contest_page') or '{}').get('digest')
+    if response.digest == previous_digest:
+        logger.info('Contest list page is not changed.')
+    else:
+        fetched_contest_list = fetchContestList(response.text)
+
+        logger.info('Diff contest list')
+        registry = db.readContestRegistry()
+        diff = diffContestList(registry, fetched_contest_list, now)
+        for label, contest_list in zip(['Added', 'Rescheduled', 'Cancelled'], diff):
+            if not contest_list.empty:
+                logger.info(label + ' contest : ' + ', '.join(contest_list['id']))
+
+        kept_id_list = replanContestReminder(db, registry, pd.concat([diff.rescheduled, diff.cancelled]))
+        db.updateContestStatus(list(diff.cancelled.index), 'cancelled')
+        rescheduled = fetched_contest_list[fetched_contest_list['id'].isin(diff.rescheduled.index)]
+        is_kept = rescheduled['id'].isin(kept_id_list)
+        db.upsertContestList(pd.concat([diff.added, rescheduled[~is_kept]]), 'upcoming')
+        # 内容は新しくするが、リマインダーは登録し直さない（次の実行で変更として検出し続けないように）
+        db.upsertContestList(rescheduled[is_kept], 'planned')
+        db.writeState('contest_page', json.dumps(response._asdict(), ensure_ascii=False))
 
     logger.info('Select new contest list')
     # コンテスト情報がいきなり変更されるかもしれないので、開始まで一日を切ったコンテストのみ登録する
-    new_contest_list = fetched_contest_list[fetched_contest_list.apply(
-        lambda contest: hasHeldToday(contest) and isNew(contest, registered_contest_list), axis=1)]
+    registry = db.readContestRegistry()
+    upcoming = registry[registry['status'] == 'upcoming']
+    new_contest_list = upcoming[isDue(upcoming, now)].reset_index(drop=True)
 
     if new_contest_list.empty:
         logger.info("There is no new contest.")
-        exit()
-
-    logger.info('Save contest list')
-    registered_contest_list.append(new_contest_list).to_pickle(contest_list_file_path)
+        return
 
     logger.info('Set contest reminder')
-    setContestReminder(new_contest_list)
+    setContestReminder(new_contest_list, db)
+    db.updateContestStatus(list(new_contest_list['id']), 'planned')
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+
+    main()
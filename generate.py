@@ -1,6 +1,7 @@
 import os
+import re
 import time
-import pickle
+import json
 import argparse
 import configparser
 import datetime as dt
@@ -10,15 +11,58 @@ import jinja2
 from PIL import Image
 from IPython import embed
 import util
+import archive
+import httpcache
+import imagecache
+import teams
 import slack
+import render
+import viewmodel
+import history
+import ratingstore
+import storage
+import metrics
 import logging
-from typing import Any, Callable, Optional, Tuple, Union, List
-
-
-def fetchContestStatistics(link: str) -> pd.DataFrame:
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple, Union, List
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# `main`で設定する
+config: configparser.ConfigParser
+team_list: List[teams.Team]
+Slack_dict: Dict[str, slack.Slack]  # チーム名ごとの投稿先
+Jinja2: jinja2.Environment
+# 描画した画像のキャッシュ（`main`で設定ファイルから作り直す、そのままではキャッシュしない）
+image_cache = imagecache.ImageCache(None)
+
+# レーティング更新の待ち方（秒）
+RATING_WAIT_TIMEOUT = 60 * 60 * 2
+RATING_POLL_INTERVAL_MIN = 30
+RATING_POLL_INTERVAL_MAX = 60 * 5
+RATING_POLL_BACKOFF = 1.5
+# countの更新とrateの更新の間にラグがあるみたいなので、更新を検知してから少し待つ（５秒で足りない可能性あり）
+RATING_SETTLE_WAIT = 5
+# 並行して実行する処理（フェッチ・描画・投稿）の数
+PIPELINE_CONCURRENCY = 4
+# チームの集計で表示する人数と、表示する連続上昇・下降の回数の下限
+SUMMARY_MOVER_COUNT = 3
+SUMMARY_STREAK_MIN = 3
+# テンプレートやチャートのファイルは作業ディレクトリに関係なくこのファイルの隣から読む
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'tpl')
+CHART_DIR = os.path.join(BASE_DIR, 'chart')
+# 描画結果に影響するファイル（描画した画像のキャッシュのキーに含める）
+RESULT_SOURCE_LIST = [render.__file__, viewmodel.__file__, os.path.join(TEMPLATE_DIR, 'result.tpl.html')]
+CHART_SOURCE_LIST = [render.__file__, viewmodel.__file__, os.path.join(TEMPLATE_DIR, 'rating.tpl.html'),
+                     os.path.join(CHART_DIR, 'chart.js'), os.path.join(CHART_DIR, 'template.html')]
+
+
+def fetchContestStatistics(link: str, affiliation: str) -> pd.DataFrame:
     """
     コンテスト結果を取得して返す
         :param link: コンテストへのLink (e.g. `/contest/abc100`)
+        :param affiliation: 所属
         :return: {
             result: {
                 (int) rank: グループ内のランキング
@@ -38,27 +82,31 @@ def fetchContestStatistics(link: str) -> pd.DataFrame:
         input = driver.find_element_by_id('input-affiliation')
         driver.execute_script(
             "document.getElementsByClassName('form-inline')[0].style.display = 'block';")
-        input.send_keys(config['atcoder']['affiliation'])
+        input.send_keys(affiliation)
 
-    raw_contest_statistics = util.scrapeTable(
-        url='https://beta.atcoder.jp' + link + '/standings?lang=en',
+    standings = util.scrapeTable(
+        url=util.ATCODER_URL + link + '/standings?lang=en',
         op=openResultViewOp
-    )[0].iloc[:-2]
+    )[0]
+    # 最後の2行は合計の行
+    raw_contest_statistics = standings.records()[:-2]
 
     """
-        返ってくるテーブルの型と例（pandas側の仕様上セルに入っているのはstringなので、すべて`split(',')`して取り出す）
+        返ってくる表の型と例（`util.Cell`のtextsにセル内のテキストが分かれて入っている）
         raw_contest_statistics = [
             {
-                Rank: [
+                Rank: Cell(texts=[
                     (int) '1' # Rank
                     (`(`+int+`)`) '(240)'  # Global rank
-                ],
-                User: [
-                    (link) /usres/hogehoge
-                    (string) hogehoge
-                ],
-                Score:
-                    when 不参加(得点・ミスなし）: ???
+                ]),
+                User: Cell(
+                    href=(link) /usres/hogehoge
+                    link_text=(string) hogehoge
+                ),
+                Score: Cell(texts=
+                    when 不参加(得点・ミスなし）: [
+                        `-`
+                    ]
                     when 得点なし: [
                         `(0)`
                     ]
@@ -67,6 +115,7 @@ def fetchContestStatistics(link: str) -> pd.DataFrame:
                         (`(`+ミス数(int)+`)` :option) (2),
                         (タイム(h:m) :option) 30:11
                     ]
+                ),
                 問題名1:
                     Scoreと同じ
                 問題名2:
@@ -77,29 +126,147 @@ def fetchContestStatistics(link: str) -> pd.DataFrame:
     """
 
     result = pd.DataFrame({
-        'rank': raw_contest_statistics.Rank.splitBy(0).astype(int),
-        'global_rank': raw_contest_statistics.Rank.splitBy(1).map(lambda x: x[1:-1]).astype(int),
-        'name': raw_contest_statistics.User.splitBy(1).astype(object),
-        'score': raw_contest_statistics.Score.splitBy(0).astype(object),
+        'rank': [int(user['Rank'].texts[0]) for user in raw_contest_statistics],
+        'global_rank': [int(user['Rank'].texts[1][1:-1]) for user in raw_contest_statistics],
+        'name': pd.Series([user['User'].link_text for user in raw_contest_statistics], dtype=object),
+        'score': pd.Series([user['Score'].texts[0] for user in raw_contest_statistics], dtype=object),
     })
 
-    def isCorrect(item: Any) -> bool:
-        return len(str(item).split(',')) >= 2
+    # 問題の列（ヘッダーが問題ページへのリンクになっている）
+    problem_list = [
+        column for column, cell in zip(standings.columns(), standings.header)
+        if cell.href is not None and '/tasks/' in cell.href
+    ]
 
-    points = raw_contest_statistics.filter(regex="^[^(Rank|User|Score)]$")
-    points = points.applymap(isCorrect)
+    def isCorrect(cell: util.Cell) -> bool:
+        return len(cell.texts) >= 2
+
+    points = pd.DataFrame(
+        [[isCorrect(user[problem]) for problem in problem_list] for user in raw_contest_statistics],
+        columns=problem_list, dtype=bool)
 
     result['isJoin'] = [
-        any(item != '-' for i, item in row.iteritems())
-        for i, row in points.iterrows()
+        any(user[problem].texts != ['-'] for problem in problem_list)
+        for user in raw_contest_statistics
     ]
 
     return {'result': result, 'points': points}
 
 
-def fetchUserList() -> pd.DataFrame:
+def parseStandingsJson(page: str, affiliation: str) -> Dict[str, pd.DataFrame]:
+    """
+    順位表のJSONから所属ユーザーのコンテスト結果を取り出して返す（`fetchContestStatistics`と同じ形）
+        :param page: `/standings/json`の中身
+        :param affiliation: 所属
+        :return: `fetchContestStatistics`と同じ
+    """
+    return filterStandings(json.loads(page), affiliation)
+
+
+def matchAffiliation(user_affiliation: str, affiliation: str) -> bool:
+    """
+    ユーザーの所属が設定の所属に当てはまるか（順位表・ランキングの所属フィルタと同じく、`*`は任意の文字列で部分一致）
+        :param user_affiliation: ユーザーの所属
+        :param affiliation: 設定の所属（ex: `*my-club*`、`my-club`）
+    """
+    pattern = '.*'.join(re.escape(part) for part in affiliation.split('*'))
+    return re.search(pattern, user_affiliation) is not None
+
+
+def filterStandings(standings: Dict[str, Any], affiliation: str) -> Dict[str, pd.DataFrame]:
+    """
+    パース済みの順位表のJSONから所属ユーザーのコンテスト結果を取り出して返す
+        :param standings: `/standings/json`をパースしたもの
+        :param affiliation: 所属
+        :return: `fetchContestStatistics`と同じ
+    """
+    """
+        standings = {
+            TaskInfo: [
+                { Assignment: (string) 'A', TaskName: ..., TaskScreenName: (string) 'abc100_a' }
+            ],
+            StandingsData: [
+                {
+                    Rank: (int) 240  # Global rank
+                    UserScreenName: (string) hogehoge
+                    Affiliation: (string) 所属
+                    TotalResult: { Score: (int) 得点*100, Count: 提出数, Penalty: ミス数, Elapsed: ... }
+                    TaskResults: {
+                        (TaskScreenName): { Score: (int) 得点*100, Count: ..., Penalty: ..., Elapsed: ... }
+                    }  # 提出していない問題は含まれない
+                }
+            ]
+        }
+    """
+    task_list = standings['TaskInfo']
+    user_result_list = sorted(
+        [user for user in standings['StandingsData'] if matchAffiliation(user.get('Affiliation') or '', affiliation)],
+        key=lambda user: user['Rank'])
+
+    def formatScore(score: int) -> str:
+        return str(score // 100) if score % 100 == 0 else str(score / 100)
+
+    global_rank_list = [user['Rank'] for user in user_result_list]
+    # 同順位のユーザーはグループ内でも同じ順位にする
+    group_rank: Dict[int, int] = {}
+    for i, rank in enumerate(global_rank_list):
+        group_rank.setdefault(rank, i + 1)
+    result = pd.DataFrame({
+        'rank': pd.Series([group_rank[rank] for rank in global_rank_list], dtype=int),
+        'global_rank': pd.Series(global_rank_list, dtype=int),
+        'name': pd.Series([user['UserScreenName'] for user in user_result_list], dtype=object),
+        'score': pd.Series([formatScore(user['TotalResult']['Score']) for user in user_result_list], dtype=object),
+        'isJoin': pd.Series([len(user['TaskResults']) > 0 for user in user_result_list], dtype=bool),
+    })
+    points = pd.DataFrame(
+        [
+            [user['TaskResults'].get(task['TaskScreenName'], {}).get('Score', 0) > 0 for task in task_list]
+            for user in user_result_list
+        ],
+        columns=[task['Assignment'] for task in task_list], dtype=bool)
+
+    return {'result': result, 'points': points}
+
+
+def fetchContestStatisticsList(link_list: List[str],
+                               affiliation_list: List[str]) -> List[List[Dict[str, pd.DataFrame]]]:
+    """
+    全所属の全コンテストの結果を取得して返す
+        :param link_list: コンテストへのLinkのリスト
+        :param affiliation_list: 所属のリスト
+        :return: 所属ごとの`fetchContestStatistics`の結果のリスト
+    """
+    # 順位表のJSONはログインしていないと取得できないので、指定が無ければセッションがあるときだけ使う
+    backend = config.get('atcoder', 'standings_backend', fallback='') \
+        or ('json' if config.get('atcoder', 'session', fallback='') else 'browser')
+    if backend == 'json':
+        # 順位表のJSONを並列にダウンロードし、一度だけパースして所属ごとに絞り込む（ブラウザを使わない）
+        try:
+            standings_list = [
+                json.loads(page)
+                for page in util.fetchAll([util.ATCODER_URL + link + '/standings/json' for link in link_list])
+            ]
+        except ValueError:
+            # セッションが切れているとログインページが返ってくる
+            logger.warning('standings json is not available (check [atcoder] session), use browser instead')
+        else:
+            return [
+                [filterStandings(standings, affiliation) for standings in standings_list]
+                for affiliation in affiliation_list
+            ]
+    return [[fetchContestStatistics(link, affiliation) for link in link_list] for affiliation in affiliation_list]
+
+
+def rankingUrl(affiliation: str) -> str:
+    return util.ATCODER_URL + '/ranking?f.Affiliation=' + affiliation
+
+
+def fetchUserList(affiliation: str, page: str = None, refresh: bool = False) -> pd.DataFrame:
     """
-    全ユーザーのデータを取得して返す
+    所属の全ユーザーのデータを取得して返す
+        :param affiliation: 所属
+        :param page: 取得済みのランキングページ（省略した場合はフェッチする）
+        :param refresh: キャッシュされたランキングページを使わない
         :return: {
             (object) name: ユーザー名
             (object) color: 色
@@ -109,32 +276,34 @@ def fetchUserList() -> pd.DataFrame:
         }
     """
 
-    def getColorOp(obj: Any) -> Optional[str]:
-        try:
-            if 'user-' in obj.span.attrs['class'][0]:
-                color = obj.span.attrs['class'][0].replace('user-', '')
-                return obj.get_text(',', strip=True) + ',' + color
-        except AttributeError:
-            pass
-        return None
-
     raw_user_list = util.scrapeTable(
-        url='https://beta.atcoder.jp/ranking?f.Affiliation=' +
-            config['atcoder']['affiliation'],
-        tableOp=getColorOp
-    )[1]
+        url=rankingUrl(affiliation),
+        page=page,
+        refresh=refresh,
+    )[1].records()
+
+    def getColor(cell: util.Cell) -> Optional[str]:
+        for c in cell.classes:
+            if c.startswith('user-'):
+                return c.replace('user-', '')
+        return None
 
     user_list = pd.DataFrame({
-        'name': raw_user_list['User'].splitBy(0).astype(object),
-        'color': raw_user_list['User'].splitBy(2).astype(object),
-        'rating': raw_user_list['Rating'].splitBy(0).astype(int),
-        'count': raw_user_list['Match'].splitBy(0).astype(int),
+        'name': pd.Series([user['User'].texts[0] for user in raw_user_list], dtype=object),
+        'color': pd.Series([getColor(user['User']) for user in raw_user_list], dtype=object),
+        'rating': pd.Series([int(user['Rating'].texts[0]) for user in raw_user_list], dtype=int),
+        'count': pd.Series([int(user['Match'].texts[0]) for user in raw_user_list], dtype=int),
     })
     user_list['rank'] = list(range(1, len(user_list) + 1))
 
     return user_list
 
 
+def renderSettings() -> List[Optional[str]]:
+    """描画結果に影響する設定（描画した画像のキャッシュのキーに含める）"""
+    return [config.get('render', 'backend', fallback='pillow'), render.font_path, render.bold_font_path]
+
+
 def generateContestResult(contest_list: pd.DataFrame,
                           contest_statistics_list: pd.DataFrame,
                           user_list: pd.DataFrame) -> Image.Image:
@@ -145,10 +314,29 @@ def generateContestResult(contest_list: pd.DataFrame,
         :param user_list: 全ユーザーデータ
         :return: 表の画像
     """
+    result_table_list = viewmodel.buildResultTableList(contest_list, contest_statistics_list, user_list)
+    cache_key = image_cache.key('result', RESULT_SOURCE_LIST, renderSettings(), result_table_list)
+    result_image = image_cache.get(cache_key)
+    if result_image is None:
+        result_image = renderContestResult(result_table_list)
+        image_cache.put(cache_key, result_image)
+    return result_image
+
+
+def renderContestResult(result_table_list: List[viewmodel.ResultTable]) -> Image.Image:
+    """
+    コンテスト結果の表を描画する（pillowで描画できなければブラウザで描画する）
+        :param result_table_list: コンテストごとの表
+        :return: 表の画像
+    """
+    if config.get('render', 'backend', fallback='pillow') == 'pillow':
+        try:
+            return render.renderResult(result_table_list)
+        except Exception:
+            logger.exception('Failed to render result with pillow, fall back to chrome')
+
     result_html = Jinja2.get_template('result.tpl.html').render({
-        'contest_list': contest_list,
-        'contest_statistics_list': contest_statistics_list,
-        'user_list': user_list,
+        'result_table_list': result_table_list,
     })
 
     result_image = util.operateBrowser(
@@ -161,242 +349,607 @@ def generateContestResult(contest_list: pd.DataFrame,
     return result_image
 
 
-def checkRatingUpdate(contest_list: pd.DataFrame,
-                      contest_statistics_list: pd.DataFrame,
-                      pre_user_list: pd.DataFrame) -> bool:
+def selectRateTargetUserList(contest_list: pd.DataFrame,
+                             contest_statistics_list: pd.DataFrame,
+                             pre_user_list: pd.DataFrame) -> List[str]:
     """
-    コンテストに参加しているレート対象者全員のレーティングが更新されたかチェックする
+    コンテストに参加しているレート対象者を返す
         :param contest_list: 全コンテスト名
         :param contest_statistics_list: 全コンテスト結果
         :param pre_user_list: コンテスト前の全ユーザーデータ
+        :return: レート対象者のユーザー名のリスト
+    """
+    pre_rating = pre_user_list.drop_duplicates('name').set_index('name')['rating']
+    target_user_name_set = set()
+    for (i, c), s in zip(contest_list.iterrows(), contest_statistics_list):
+        result = s['result']
+        rating = result['name'].map(pre_rating)
+        # 前回のデータに無いユーザーはレート上限に関係なく対象にする
+        is_target = result['isJoin'].astype(bool) & (rating.isnull() | (rating <= c['rating_limit']))
+        target_user_name_set.update(result.loc[is_target, 'name'])
+    return sorted(target_user_name_set)
+
+
+def checkRatingUpdate(target_user_name_list: List[str],
+                      user_list: pd.DataFrame,
+                      pre_user_list: pd.DataFrame) -> bool:
+    """
+    コンテストに参加しているレート対象者全員のレーティングが更新されたかチェックする
+        :param target_user_name_list: レート対象者のユーザー名のリスト
+        :param user_list: 現在の全ユーザーデータ
+        :param pre_user_list: コンテスト前の全ユーザーデータ
         :return: (bool) 更新されたか
     """
-    def selectRateTargetUser(contest: pd.DataFrame, statistics: pd.DataFrame) -> pd.DataFrame:
-        def isRateTargetUser(user_result: pd.Series) -> bool:
-            pre_user = pre_user_list[pre_user_list['name']
-                                     == user_result['name']]
-            if pre_user.empty:
-                return user_result['isJoin']
-            else:
-                return user_result['isJoin'] and ((int)(pre_user['rating']) <= (int)(contest['rating_limit']))
-        return statistics['result'][statistics['result'].apply(isRateTargetUser, axis=1)]
-
-    def checkChangeRate(user: pd.Series) -> Optional[bool]:
-        pre_user = pre_user_list[pre_user_list['name'] == user['name']]
-        if pre_user.empty:
-            return None
-        if int(user['count']) - int(pre_user['count']) != 0:
-            return True
-        return False
-
-    user_list = fetchUserList()
-
-    target_user_name_list = set(
-        user
-        for (i, c), s in zip(contest_list.iterrows(), contest_statistics_list)
-        for user in list(selectRateTargetUser(c, s)['name']))
-    target_user_list = user_list[user_list['name'].isin(
-        target_user_name_list)].copy()
-    target_user_list['isNewUser'] = ~target_user_list['name'].isin(
-        pre_user_list['name'])
-    target_user_list['hasRateChanged'] = target_user_list.apply(
-        checkChangeRate, axis=1)
+    target_user_list = pd.merge(
+        user_list[user_list['name'].isin(target_user_name_list)],
+        pre_user_list[['name', 'count']].drop_duplicates('name'),
+        on='name', how='left', suffixes=('', '_pre'))
+    target_user_list['isNewUser'] = target_user_list['count_pre'].isnull()
+    target_user_list['hasRateChanged'] = ~target_user_list['isNewUser'] & (
+        target_user_list['count'] != target_user_list['count_pre'])
     logger.info('rated user  : ' + ','.join(target_user_list['name'].values))
     logger.info('change user : '
-                + ','.join(target_user_list[target_user_list['hasRateChanged'] == True]['name'].values))
+                + ','.join(target_user_list[target_user_list['hasRateChanged']]['name'].values))
     logger.info('(new user)  : ' +
                 ','.join(target_user_list[target_user_list['isNewUser']]['name'].values))
-    if (target_user_list['isNewUser'] | (target_user_list['hasRateChanged'] == True)).all():
+    if (target_user_list['isNewUser'] | target_user_list['hasRateChanged']).all():
         return True
     else:
         return False
 
 
-def generateContestChart(current_user_list: pd.DataFrame,
-                         pre_user_list: pd.DataFrame) -> Image.Image:
+def waitRatingUpdate(target_user_name_list: List[str],
+                     pre_user_list: pd.DataFrame,
+                     affiliation: str,
+                     timeout: float = RATING_WAIT_TIMEOUT,
+                     on_change: Callable[[pd.DataFrame], None] = None) -> bool:
     """
-    全ユーザーデータからレーティングチャートを作成して返す
-        :param uesr_list: 全ユーザーデータ
+    レート対象者全員のレーティングが更新されるまでランキングページを監視する
+
+    ページが変わっていないときはパースせずに次の確認まで待ち、待ち時間は指数的に伸ばす（変化があれば初期値に戻す）。
+        :param target_user_name_list: レート対象者のユーザー名のリスト
         :param pre_user_list: コンテスト前の全ユーザーデータ
-        :return: レーティングチャートの画像
+        :param affiliation: 所属
+        :param timeout: 諦めるまでの秒数
+        :param on_change: ランキングページが変わるたびに、パースした全ユーザーデータを受け取る
+        :return: (bool) 時間内に更新されたか
     """
-    user_list = pd.merge(current_user_list, pre_user_list,
-                         on='name', how='left', suffixes=('_current', '_pre'))
+    watcher = util.PageWatcher(rankingUrl(affiliation))
+    deadline = time.monotonic() + timeout
+    interval: float = RATING_POLL_INTERVAL_MIN
+    while True:
+        page = watcher.poll()
+        if page is None:
+            logger.info('Ranking page has not changed')
+            interval = min(interval * RATING_POLL_BACKOFF, RATING_POLL_INTERVAL_MAX)
+        else:
+            user_list = fetchUserList(affiliation, page)
+            if on_change is not None:
+                on_change(user_list)
+            if checkRatingUpdate(target_user_name_list, user_list, pre_user_list):
+                return True
+            logger.info('Not all rates have been updated yet...')
+            interval = RATING_POLL_INTERVAL_MIN
+        if time.monotonic() + interval > deadline:
+            return False
+        time.sleep(interval)
 
-    user_list['rating_diff'] = user_list.apply(
-        lambda user: user['rating_current'] - user['rating_pre'] if not np.isnan(user['rating_pre']) else 0, axis=1)
-    user_list['rank_diff'] = user_list.apply(
-        lambda user: user['rank_pre'] - user['rank_current'] if not np.isnan(user['rank_pre']) else 0, axis=1)
 
-    logger.info('get users chart')
-    user_chart_list = [
-        util.scrape('https://beta.atcoder.jp/users/' + user['name'],
-                    '//*[@id="main-container"]/div[1]/div[3]/div/script[2]/text()')[0][4:-1]
-        for i, user in current_user_list.iterrows()
+def generateRatingTable(user_list: pd.DataFrame) -> Image.Image:
+    """
+    レーティングの表を作成して返す
+        :param user_list: レーティングの差分付きの全ユーザーデータ
+        :return: 表の画像
+    """
+    rating_row_list = viewmodel.buildRatingRowList(user_list)
+    if config.get('render', 'backend', fallback='pillow') == 'pillow':
+        try:
+            return render.renderRating(rating_row_list)
+        except Exception:
+            logger.exception('Failed to render rating with pillow, fall back to chrome')
+
+    rating_html = Jinja2.get_template('rating.tpl.html').render({
+        'rating_row_list': rating_row_list,
+    })
+
+    return util.operateBrowser(
+        page=rating_html,
+        return_screenshot=True,
+        width=640,
+        height=270,
+    )
+
+
+def parseRatingHistory(chart: str) -> history.RatingHistory:
+    """
+    ユーザーページに埋め込まれている`rating_history=[...]`をパースする
+        :param chart: `rating_history=[...]`の形の文字列
+        :return: [{
+            (int) EndTime: コンテストの終了時刻（UNIX時間）
+            (int) NewRating: コンテスト後のレーティング
+            ...
+        }]
+    """
+    return json.loads(chart[chart.index('=') + 1:])
+
+
+def fetchStaleRatingHistory(user_list: pd.DataFrame,
+                            history_cache: history.RatingHistoryCache,
+                            refresh: bool = False) -> Dict[str, history.RatingHistory]:
+    """
+    キャッシュに無い（コンテスト参加回数が変わった）ユーザーのレーティング履歴をフェッチする
+
+    参加回数だけ先に更新されて履歴にはまだ反映されていないことがあるので、
+    履歴の数が参加回数と一致したものだけをキャッシュに入れる（一致しないものは次の実行でもう一度フェッチする）。
+        :param user_list: 全ユーザーデータ
+        :param history_cache: レーティング履歴のキャッシュ
+        :param refresh: レスポンスのキャッシュが新しくてもサーバーに問い合わせる
+        :return: フェッチしたユーザーごとのレーティング履歴（キャッシュに入れなかったものも含む）
+    """
+    stale_user_list = user_list[[
+        history_cache.get(user['name'], int(user['count'])) is None for i, user in user_list.iterrows()
+    ]]
+    if stale_user_list.empty:
+        return {}
+    logger.info('fetch rating history : ' + ','.join(stale_user_list['name']))
+    fetched_chart_list = util.scrapeAll(
+        [util.ATCODER_URL + '/users/' + name for name in stale_user_list['name']],
+        '//*[@id="main-container"]/div[1]/div[3]/div/script[2]/text()',
+        refresh=refresh)
+    fetched_dict = {}
+    for (i, user), chart in zip(stale_user_list.iterrows(), fetched_chart_list):
+        rating_history = parseRatingHistory(chart[0][4:-1])
+        fetched_dict[user['name']] = rating_history
+        if len(rating_history) != int(user['count']):
+            logger.warning('rating history of %s is not updated yet (%d of %d), do not cache it'
+                           % (user['name'], len(rating_history), int(user['count'])))
+            continue
+        history_cache.put(user['name'], int(user['count']), rating_history)
+    return fetched_dict
+
+
+def fetchRatingHistoryList(user_list: pd.DataFrame,
+                           history_cache: history.RatingHistoryCache,
+                           member_name_list: Optional[Iterable[str]] = None) -> List[Tuple[str, history.RatingHistory]]:
+    """
+    全ユーザーのレーティング履歴を返す（前回からコンテスト参加回数が変わったユーザーのみフェッチする）
+        :param user_list: 全ユーザーデータ
+        :param history_cache: レーティング履歴のキャッシュ
+        :param member_name_list: キャッシュに残すユーザー（全チームのユーザー、省略した場合は`user_list`のユーザー）
+        :return: (ユーザー名, レーティング履歴)のリスト（キャッシュに入れなかった履歴はこの実行だけで使う）
+    """
+    # 先読みで履歴が未反映だったページがレスポンスのキャッシュに残っているので、サーバーに問い合わせ直す
+    fetched_dict = fetchStaleRatingHistory(user_list, history_cache, refresh=True)
+
+    history_cache.evict(user_list['name'] if member_name_list is None else member_name_list)
+    history_cache.save()
+
+    return [
+        (user['name'], history_cache.get(user['name'], int(user['count'])) or fetched_dict.get(user['name']) or [])
+        for i, user in user_list.iterrows()
+    ]
+
+
+def chartRangeList() -> List[render.ChartRange]:
+    """
+    チャートのレート帯ごとの範囲
+
+    右端は同じ日なら同じになるように1日単位で切り上げる（描画した画像のキャッシュが再実行で使えるように）。
+    """
+    # 左端のタイムスタンプ,右端のタイムスタンプ,レート下限,レート上限
+    day = 60 * 60 * 24
+    date_begin, date_end = 1521540800, -(-int(dt.datetime.now().timestamp()) // day) * day + 1000000
+    return [
+        render.ChartRange(date_begin, date_end, 1200, 2800),
+        render.ChartRange(date_begin, date_end, 0, 1200),
     ]
 
-    def generateChart(chart_range: Tuple[int, int, int, int]) -> Image.Image:
+
+def generateRatingChart(user_chart_list: List[Tuple[str, history.RatingHistory]],
+                        executor: Executor = None) -> Image.Image:
+    """
+    ユーザーのレーティング履歴からレート帯ごとのチャートを作成して返す
+        :param user_chart_list: (ユーザー名, レーティング履歴)のリスト
+        :param executor: 指定した場合はレート帯ごとに並列に描画する
+        :return: チャートの画像
+    """
+    chart_range_list = chartRangeList()
+
+    if config.get('render', 'backend', fallback='pillow') == 'pillow':
+        try:
+            return render.renderChart(user_chart_list, chart_range_list, executor)
+        except Exception:
+            logger.exception('Failed to render chart with pillow, fall back to chrome')
+
+    def generateChart(chart_range: render.ChartRange) -> Image.Image:
+        # chart.jsは桁あふれ対策で時刻を1/100にしたものを受け取る
+        js_range = (chart_range.date_begin // 100, chart_range.date_end // 100,
+                    chart_range.rate_min, chart_range.rate_max)
+
         def printChartOp(driver: Any) -> None:
-            for ((i, u), chart) in zip(user_list.iterrows(), user_chart_list):
+            for (name, rating_history) in user_chart_list:
+                if not rating_history:
+                    continue
+                chart = 'rating_history=' + json.dumps(rating_history)
                 logger.info('paintNewChart('
                             + ','.join([
                                 chart,
-                                'user_name="%s"' % u['name'],
-                                "date_begin=%d, date_end=%d, rate_min=%d, rate_max=%d" % chart_range
+                                'user_name="%s"' % name,
+                                "date_begin=%d, date_end=%d, rate_min=%d, rate_max=%d" % js_range
                             ])
                             + ')')
                 driver.execute_script('paintNewChart('
                                       + ','.join([
                                           chart,
-                                          'user_name="%s"' % u['name'],
-                                          "date_begin=%d, date_end=%d, rate_min=%d, rate_max=%d" % chart_range
+                                          'user_name="%s"' % name,
+                                          "date_begin=%d, date_end=%d, rate_min=%d, rate_max=%d" % js_range
                                       ])
                                       + ')')
 
         # Save web page with image
         return util.operateBrowser(
             # このhtmlとchart.jsはAtcoderのサイトからダウンロードしたものを適当に書き換えたもの
-            url='file://' + os.getcwd() + '/chart/template.html',
+            url='file://' + os.path.join(CHART_DIR, 'template.html'),
             return_screenshot=True,
-            op=printChartOp)
+            op=printChartOp,
+            region=(0, 0, 700, 400))
 
-    # 左端のタイムスタンプ,右端のタイムスタンプ,レート下限,レート上限
-    im1 = generateChart(((int)(1521540800/100), (int)
-                         ((int(dt.datetime.now().timestamp()) + 1000000)/100), 1200, 2800))
-    im2 = generateChart(((int)(1521540800/100), (int)
-                         ((int(dt.datetime.now().timestamp()) + 1000000)/100), 0, 1200))
-    im1 = im1.crop((0, 0, 700, 400))
-    im2 = im2.crop((0, 0, 700, 400))
-    chart_image = util.concat_images_vertical(im1, im2)
-
-    logger.info('generate contest result')
-    rating_html = Jinja2.get_template('rating.tpl.html').render({
-        'user_list': user_list,
-    })
+    im1, im2 = (executor.map if executor is not None else map)(generateChart, chart_range_list)
+    return util.concat_images_vertical(im1, im2)
+
+
+def diffUserList(current_user_list: pd.DataFrame, pre_user_list: pd.DataFrame) -> pd.DataFrame:
+    """
+    コンテスト前後のユーザーデータを結合し、レーティングと順位の変化を付けて返す
+        :param current_user_list: 全ユーザーデータ
+        :param pre_user_list: コンテスト前の全ユーザーデータ
+        :return: {
+            (object) name: ユーザー名
+            (*) *_current, *_pre: コンテスト後、前のユーザーデータ
+            (int) rating_diff: レーティングの変化（前回のデータに無いユーザーは0）
+            (int) rank_diff: グループ内順位の変化（上がった場合に正、前回のデータに無いユーザーは0）
+        }
+    """
+    user_list = pd.merge(current_user_list, pre_user_list.drop_duplicates('name'),
+                         on='name', how='left', suffixes=('_current', '_pre'))
+    user_list['rating_diff'] = (
+        user_list['rating_current'] - pd.to_numeric(user_list['rating_pre'])).fillna(0).astype(int)
+    user_list['rank_diff'] = (
+        pd.to_numeric(user_list['rank_pre']) - user_list['rank_current']).fillna(0).astype(int)
+    return user_list
 
-    rating_image = util.operateBrowser(
-        page=rating_html,
-        return_screenshot=True,
-        width=640,
-        height=270,
-    )
+
+def generateContestChart(current_user_list: pd.DataFrame,
+                         pre_user_list: pd.DataFrame,
+                         rating_history_dict: Dict[str, history.RatingHistory],
+                         executor: Executor = None) -> Image.Image:
+    """
+    全ユーザーデータからレーティングチャートを作成して返す
+        :param uesr_list: 全ユーザーデータ
+        :param pre_user_list: コンテスト前の全ユーザーデータ
+        :param rating_history_dict: ユーザー名ごとのレーティング履歴（`fetchRatingHistoryList`の結果）
+        :param executor: 指定した場合はチャートのレート帯と表を並列に描画する（executorのスレッドから呼ばないこと）
+        :return: レーティングチャートの画像
+    """
+    user_list = diffUserList(current_user_list, pre_user_list)
+
+    user_chart_list = [(name, rating_history_dict.get(name, [])) for name in current_user_list['name']]
+
+    cache_key = image_cache.key('chart', CHART_SOURCE_LIST, renderSettings(), chartRangeList(),
+                                viewmodel.buildRatingRowList(user_list), user_chart_list)
+    contest_chart = image_cache.get(cache_key)
+    if contest_chart is not None:
+        return contest_chart
+
+    if executor is None:
+        chart_image = generateRatingChart(user_chart_list)
+        rating_image = generateRatingTable(user_list)
+    else:
+        # 表はチャートのレート帯と同時に描画する
+        rating_future = executor.submit(generateRatingTable, user_list)
+        chart_image = generateRatingChart(user_chart_list, executor)
+        rating_image = rating_future.result()
 
     # ２つのページをくっつける
     contest_chart = util.concat_images_horizontal(rating_image, chart_image)
+    image_cache.put(cache_key, contest_chart)
 
     return contest_chart
 
 
-if __name__ == '__main__':
-    logging.basicConfig()
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.INFO)
-
-    parser = argparse.ArgumentParser()
-    parser.add_argument('contest_id_list', nargs='+',)
-    parser.add_argument('--mode', default='deployment')
-    args = parser.parse_args()
+def main(contest_id_list: List[str],
+         mode: str = 'deployment',
+         config_path: str = 'config.ini',
+         data_path: str = None) -> None:
+    """
+    コンテスト結果とレーティングの変化を投稿する
+        :param contest_id_list: 同時に終わったコンテストのLinkのリスト
+        :param mode: `deployment`か`test`（テスト用のチャンネルに投稿し、`tmp/data`を使う）
+        :param config_path: 設定ファイル
+        :param data_path: DBなどを置くディレクトリ（省略した場合は`mode`で決まる）
+    """
+    global config, team_list, Slack_dict, Jinja2, image_cache
 
     config = configparser.ConfigParser()
-    config.read('config.ini')
+    config.read(config_path)
+    util.ATCODER_URL = config.get('atcoder', 'base_url', fallback=util.ATCODER_URL)
+    util.page_archive = archive.openArchive(config)
+    util.response_cache = httpcache.openResponseCache(config)
+
+    team_list = teams.readTeamList(config)
+    Slack_dict = teams.openSlackDict(config, mode)
+
+    if config.get('atcoder', 'session', fallback=''):
+        # 順位表のJSONはログインしていないと取得できない
+        util.session.cookies.set('REVEL_SESSION', config['atcoder']['session'])
+
+    render.setFont(config.get('render', 'font_path', fallback=None),
+                   config.get('render', 'bold_font_path', fallback=None))
+    image_cache = imagecache.openImageCache(config)
+
+    # コンパイル済みのテンプレートはディレクトリに残して次の実行でも使う（空の場合は一時ディレクトリ）
+    template_cache_dir = config.get('render', 'template_cache_dir', fallback='') or None
+    if template_cache_dir is not None:
+        os.makedirs(template_cache_dir, exist_ok=True)
+    Jinja2 = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(searchpath=TEMPLATE_DIR, encoding='utf8'),
+        bytecode_cache=jinja2.FileSystemBytecodeCache(template_cache_dir))
 
-    Slack = slack.Slack(
-        channel=config['slack']['channel_name']
-        if args.mode == 'deployment' else config['slack']['test_channel_name'],
-        token=config['slack']['token']
-    )
+    logger.info('Contest list: ' + ' '.join(contest_id_list))
 
-    Jinja2 = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(searchpath='./tpl', encoding='utf8'))
-    Jinja2.globals.update(
-        zip=zip,
-        list=list,
-        str=str,
-        int=int,
+    if data_path is None:
+        data_path = 'data' if mode == 'deployment' else 'tmp/data'
+    with metrics.run(config.get('metrics', 'path', fallback='log/trace.jsonl'),
+                     contest_id_list=contest_id_list, mode=mode):
+        run(contest_id_list, data_path)
+
+
+def postContestResult(team: teams.Team,
+                      contest_list: pd.DataFrame,
+                      contest_statistics_list: List[Dict[str, pd.DataFrame]],
+                      user_list_future: 'Future[pd.DataFrame]') -> None:
+    """
+    チームのコンテスト結果の画像を作成して投稿する（レーティング更新待ちと並行して実行する）
+        :param team: チーム
+        :param contest_list: 全コンテスト名
+        :param contest_statistics_list: チームの全コンテスト結果
+        :param user_list_future: チームの全ユーザーデータ
+    """
+    with metrics.span('render_result'):
+        result = generateContestResult(contest_list, contest_statistics_list, user_list_future.result())
+    with metrics.span('post_result'):
+        Slack_dict[team.name].postImage(
+            'result-' + str(dt.datetime.now().timestamp()) + '.png',
+            'Contest Result',
+            image=result
+        )
+
+
+def postContestChart(team: teams.Team, chart: Image.Image, summary: str) -> None:
+    """
+    チームのレーティングチャートと集計を投稿する
+        :param team: チーム
+        :param chart: レーティングチャートの画像
+        :param summary: チームの集計（`generateTeamSummary`）
+    """
+    Slack_dict[team.name].postImage(
+        'chart-' + str(dt.datetime.now().timestamp()) + '.png',
+        'Rating Update',
+        image=chart
     )
+    Slack_dict[team.name].post(summary)
 
-    logger.info('Contest list: ' + ' '.join(args.contest_id_list))
 
-    data_path = 'data' if args.mode == 'deployment' else 'tmp/data'
-    contest_list_path = data_path + '/contest_list.pickle'
-    user_list_path = data_path + '/user_list.pickle'
+def generateTeamSummary(rating_store: ratingstore.RatingStore, user_name_list: List[str], since: float) -> str:
+    """
+    チームの平均・分位点・大きく変動したユーザー・連続上昇/下降中のユーザーをSlackに投稿する文章にする
+        :param rating_store: 全ユーザーのレーティング履歴
+        :param user_name_list: チームのユーザー名のリスト
+        :param since: このUNIX時間からの変化を集計する（コンテストの開始時刻）
+        :return: 投稿する文章
+    """
+    time_list, average_list = rating_store.averageTimeline(user_name_list)
+    if len(time_list) == 0:
+        return 'まだレーティングのあるメンバーがいません'
+    line_list = []
+    before = np.searchsorted(time_list, since, side='right') - 1
+    line_list.append('チームの平均レーティング: %d' % round(average_list[-1]) + (
+        '' if before < 0 else ' (%+d)' % round(average_list[-1] - average_list[before])))
+    line_list.append('25%% / 50%% / 75%%: %d / %d / %d' % tuple(
+        rating_store.percentiles(user_name_list, [25, 50, 75]).round()))
+
+    mover_list = rating_store.biggestMovers(user_name_list, since, SUMMARY_MOVER_COUNT)
+    if mover_list:
+        line_list.append('大きく変動: ' + '、'.join(
+            '%s %d → %d (%+d)' % (name, before_rating, after_rating, after_rating - before_rating)
+            for name, before_rating, after_rating in mover_list))
+
+    streak_list = rating_store.streaks(user_name_list)
+    for sign, label in [(1, '連続上昇中'), (-1, '連続下降中')]:
+        index_list = np.flatnonzero(streak_list * sign >= SUMMARY_STREAK_MIN)
+        index_list = index_list[np.argsort(-streak_list[index_list] * sign, kind='stable')][:SUMMARY_MOVER_COUNT]
+        if len(index_list) > 0:
+            line_list.append(label + ': ' + '、'.join(
+                '%s (%d回)' % (user_name_list[i], streak_list[i] * sign) for i in index_list))
+    return '\n'.join(line_list)
+
+
+def prefetchRatingHistory(user_list: pd.DataFrame,
+                          pre_user_list: pd.DataFrame,
+                          history_cache: history.RatingHistoryCache) -> None:
+    """
+    レーティングが更新されたユーザーの履歴を先にフェッチしておく（失敗しても後でもう一度フェッチする）
+        :param user_list: 現在の全ユーザーデータ
+        :param pre_user_list: コンテスト前の全ユーザーデータ
+        :param history_cache: レーティング履歴のキャッシュ
+    """
+    pre_count = pre_user_list.drop_duplicates('name').set_index('name')['count']
+    updated_user_list = user_list[user_list['count'] != user_list['name'].map(pre_count)]
+    try:
+        with metrics.span('prefetch_rating_history'):
+            fetchStaleRatingHistory(updated_user_list, history_cache)
+    except Exception:
+        logger.exception('Failed to prefetch rating history')
+
+
+def run(contest_id_list: List[str], data_path: str) -> None:
+    """
+    `main`の本体（各段階の所要時間を`metrics`に記録する）
+
+    待ち時間の長い段階が重なるように、独立した処理はスレッドプールで並行して実行する。
+    - ユーザー情報は順位表と同時に取得する
+    - コンテスト結果の画像の作成と投稿は、レーティング更新待ちと並行して行う
+    - レーティング更新待ちの間に、更新されたユーザーのレーティング履歴を先読みする
+    - チャートのレート帯とレーティングの表は同時に描画する
+        :param contest_id_list: 同時に終わったコンテストのLinkのリスト
+        :param data_path: DBなどを置くディレクトリ
+    """
+    with ThreadPoolExecutor(max_workers=PIPELINE_CONCURRENCY,
+                            initializer=metrics.attach, initargs=(metrics.current(),)) as executor:
+        runPipeline(contest_id_list, data_path, executor)
+
+
+def runPipeline(contest_id_list: List[str], data_path: str, executor: Executor) -> None:
+    rating_history_path = data_path + '/rating_history.json'
 
     # コンテスト情報のロード
     logger.info('Load contest data')
-    all_contest_list = pickle.load(open(contest_list_path, 'rb'))
-    contest_list = all_contest_list[all_contest_list.id.isin(
-        args.contest_id_list)]
-    if len(contest_list) != len(args.contest_id_list):
+    metrics.stage('load_contest')
+    db = storage.openStorage(data_path)
+    contest_list = db.findContestList(contest_id_list)
+    if len(contest_list) != len(contest_id_list):
         logger.error('A few contests does not exist in DB.')
-        exit()
+        return
 
-    # コンテスト結果のフェッチ
+    # ユーザー情報は順位表と関係ないので、順位表と並行してフェッチする
+    logger.info('Fetch user statistics')
+    user_list_future_dict = {team.name: executor.submit(fetchUserList, team.affiliation) for team in team_list}
+
+    # コンテスト結果のフェッチ（順位表は全チームで一度だけ取得し、チームごとに所属で絞り込む）
     logger.info('Fetch contest statistics')
-    contest_statistics_list = list(
-        map(fetchContestStatistics, args.contest_id_list))
-    if all(cs['result'].empty for cs in contest_statistics_list):
+    metrics.stage('fetch_statistics')
+    contest_statistics_dict = dict(zip(
+        [team.name for team in team_list],
+        fetchContestStatisticsList(contest_id_list, [team.affiliation for team in team_list])))
+    for team in team_list:
+        for contest_id, contest_statistics in zip(contest_id_list, contest_statistics_dict[team.name]):
+            db.appendContestStatistics(contest_id, contest_statistics, team.name)
+    played_team_list = [
+        team for team in team_list
+        if not all(cs['result'].empty for cs in contest_statistics_dict[team.name])
+    ]
+    if not played_team_list:
         logger.info('No one play any contest.')
-        exit()
-
-    # ユーザー情報のフェッチ
-    logger.info('Fetch user statistics')
-    user_list = fetchUserList()
-
-    # コンテスト結果画像の生成
-    logger.info('Generate contest result image')
-    result = generateContestResult(
-        contest_list, contest_statistics_list, user_list)
-
-    # コンテスト結果を投稿
-    logger.info('Post contest result')
-    Slack.postImage(
-        'result-' + str(dt.datetime.now().timestamp()) + '.png',
-        'Contest Result',
-        image=result
-    )
+        return
+
+    # コンテスト結果の画像の生成と投稿（待たずにレーティング更新待ちに進む）
+    logger.info('Generate and post contest result image')
+    post_future_list = [
+        executor.submit(postContestResult, team, contest_list, contest_statistics_dict[team.name],
+                        user_list_future_dict[team.name])
+        for team in played_team_list
+    ]
 
     # レート対象でないコンテストを除外
     contest_list = contest_list[contest_list['is_rating'] == True]
     if len(contest_list) == 0:
         logger.info('Rated contest does not exist. finish.')
-        exit()
+        for future in post_future_list:
+            future.result()
+        return
 
     # 前回のユーザー情報のロード
-    pre_user_list = pickle.load(open(user_list_path, 'rb')) if os.path.exists(
-        user_list_path) else pd.DataFrame(columns=['color', 'count', 'name', 'rating', 'rank'])
+    pre_user_list_dict = {team.name: db.readLatestUserList(team.name) for team in played_team_list}
+    history_cache = history.RatingHistoryCache(rating_history_path)
 
-    # レートが更新されるまで待つ
+    # レートが更新されるまで待つ（全チーム同時に更新されるので、2チーム目からはすぐに終わる）
+    # 待っている間に、レーティングが更新されたユーザーの履歴を先読みする
     logger.info('Wait rating update')
-    rate_has_change = False
-    for time_count in range(0, 60 * 2):
-        if checkRatingUpdate(contest_list, contest_statistics_list, pre_user_list):
-            rate_has_change = True
-            break
+    metrics.stage('wait_rating')
+    deadline = time.monotonic() + RATING_WAIT_TIMEOUT
+    prefetch_future_list: List[Future] = []
+    updated_team_list = []
+    for team in played_team_list:
+        target_user_name_list = selectRateTargetUserList(
+            contest_list, contest_statistics_dict[team.name], pre_user_list_dict[team.name])
+
+        def onChange(user_list: pd.DataFrame, pre_user_list: pd.DataFrame = pre_user_list_dict[team.name]) -> None:
+            prefetch_future_list.append(executor.submit(prefetchRatingHistory, user_list, pre_user_list, history_cache))
+
+        if waitRatingUpdate(target_user_name_list, pre_user_list_dict[team.name], team.affiliation,
+                            max(0.0, deadline - time.monotonic()), onChange):
+            logger.info('Rate change! : ' + team.label())
+            updated_team_list.append(team)
         else:
-            logger.info('Not all rates have been updated yet...')
-        time.sleep(60)
-    if rate_has_change:
-        logger.info('Rate change!')
-        time.sleep(5)  # countの更新とrateの更新の間にラグがあるみたいなので少し待ってみる（５秒で足りない可能性あり）
-    else:
+            logger.info('Time out! cannot detect change rating : ' + team.label())
+    for future in post_future_list:
+        future.result()
+    if not updated_team_list:
         logger.info('Time out! cannot detect change rating... exit.')
-        exit()
+        return
+    time.sleep(RATING_SETTLE_WAIT)
 
     # 更新後のユーザー情報のフェッチ、DBに保存
     logger.info('Fetch and save updated user statistics')
-    updated_user_list = fetchUserList()
-    updated_user_list.to_pickle(user_list_path)
+    metrics.stage('fetch_updated_users')
+    updated_user_list_dict = dict(zip(
+        [team.name for team in updated_team_list],
+        executor.map(lambda team: fetchUserList(team.affiliation, refresh=True), updated_team_list)))
+    for team in updated_team_list:
+        db.appendUserList(updated_user_list_dict[team.name], team=team.name)
+
+    # レーティング履歴のフェッチ（先読みできなかったユーザーのみ、全チームのユーザーをまとめて一度だけ取得する）
+    logger.info('Fetch rating history')
+    metrics.stage('fetch_rating_history')
+    for future in prefetch_future_list:
+        future.result()
+    all_user_list = pd.concat(list(updated_user_list_dict.values())).drop_duplicates('name')
+    # レーティングが更新されなかったチーム（タイムアウトなど）のユーザーの履歴もキャッシュに残す
+    member_name_set = set(all_user_list['name']).union(*[db.readLatestUserList(team.name)['name'] for team in team_list])
+    rating_history_dict = dict(fetchRatingHistoryList(all_user_list, history_cache, member_name_set))
+
+    # レーティング履歴を列ごとの保存先に取り込み、チームごとに集計する
+    logger.info('Summarize team rating')
+    metrics.stage('summarize_rating')
+    rating_store = ratingstore.RatingStore(data_path + '/rating_store')
+    if rating_store.update(rating_history_dict.items()) > 0:
+        rating_store.save()
+    since = contest_list['date'].min().to_pydatetime().timestamp()
+    summary_dict = {
+        team.name: generateTeamSummary(rating_store, list(updated_user_list_dict[team.name]['name']), since)
+        for team in updated_team_list
+    }
 
     # チャート画像の生成
     logger.info('Generate contest chart image')
-    chart = generateContestChart(updated_user_list, pre_user_list)
+    metrics.stage('render_chart')
+    chart_dict = {
+        team.name: generateContestChart(
+            updated_user_list_dict[team.name], pre_user_list_dict[team.name], rating_history_dict, executor)
+        for team in updated_team_list
+    }
 
     # チャートを投稿
     logger.info('Post chart')
-    Slack.postImage(
-        'chart-' + str(dt.datetime.now().timestamp()) + '.png',
-        'Rating Update',
-        image=chart
-    )
+    metrics.stage('post_chart')
+    for future in [
+        executor.submit(postContestChart, team, chart_dict[team.name], summary_dict[team.name])
+        for team in updated_team_list
+    ]:
+        future.result()
 
     logger.info('Post ok, all done!')
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('contest_id_list', nargs='+',)
+    parser.add_argument('--mode', default='deployment')
+    parser.add_argument('--config', default='config.ini')
+    args = parser.parse_args()
+
+    main(args.contest_id_list, args.mode, args.config)
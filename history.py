@@ -0,0 +1,54 @@
+import os
+import io
+import json
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+RatingHistory = List[Dict[str, Any]]
+
+
+class RatingHistoryCache():
+    """
+    ユーザーごとのレーティング履歴のキャッシュ
+
+    レーティング履歴は追記しかされないので、コンテスト参加回数（`count`）が変わっていなければ
+    前回取得した履歴をそのまま使える。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        # レーティング更新待ちの間に別スレッドで先読みするので、書き込みは排他にする
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with io.open(path, encoding='utf-8') as fh:
+                    self._entries = json.load(fh)
+            except ValueError:
+                logger.warning('broken rating history cache, ignore it: ' + path)
+
+    def get(self, name: str, count: int) -> Optional[RatingHistory]:
+        entry = self._entries.get(name)
+        if entry is None or entry['count'] != count:
+            return None
+        return entry['history']
+
+    def put(self, name: str, count: int, history: RatingHistory) -> None:
+        with self._lock:
+            self._entries[name] = {'count': count, 'history': history}
+
+    def evict(self, name_list: Iterable[str]) -> None:
+        """`name_list`に含まれないユーザー（所属から抜けたユーザー）を削除する"""
+        keep = set(name_list)
+        with self._lock:
+            for name in [name for name in self._entries if name not in keep]:
+                del self._entries[name]
+
+    def save(self) -> None:
+        tmp_path = self.path + '.tmp'
+        with self._lock, io.open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(self._entries, fh, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,160 @@
+import os
+import io
+import json
+import time
+import hashlib
+import threading
+import logging
+import lru
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class CachedResponse(NamedTuple):
+    """キャッシュしたレスポンス"""
+    url: str
+    text: str
+    digest: str  # 本文のsha1
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float  # 取得（もしくは304で再検証）したUNIX時間
+    max_age: Optional[float]  # `Cache-Control: max-age`（無ければNone）
+
+
+def parseCacheControl(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """`Cache-Control`ヘッダーを{ディレクティブ: 値}にする"""
+    directive_dict: Dict[str, Optional[str]] = {}
+    for directive in (value or '').split(','):
+        name, _, argument = directive.strip().partition('=')
+        if name:
+            directive_dict[name.lower()] = argument.strip('"') or None
+    return directive_dict
+
+
+def makeCachedResponse(url: str, response: Any) -> Optional[CachedResponse]:
+    """
+    requestsのレスポンスからキャッシュするエントリーを作る（`no-store`の場合はNone）
+        :param url: 取得したURL
+        :param response: `requests.Response`
+    """
+    cache_control = parseCacheControl(response.headers.get('Cache-Control'))
+    if 'no-store' in cache_control:
+        return None
+    max_age: Optional[float] = None
+    if 'no-cache' in cache_control:
+        max_age = 0
+    elif cache_control.get('max-age') is not None:
+        try:
+            max_age = float(cache_control['max-age'] or 0)
+        except ValueError:
+            pass
+    return CachedResponse(
+        url=url,
+        text=response.text,
+        digest=hashlib.sha1(response.content).hexdigest(),
+        etag=response.headers.get('ETag'),
+        last_modified=response.headers.get('Last-Modified'),
+        fetched_at=time.time(),
+        max_age=max_age,
+    )
+
+
+class ResponseCache():
+    """
+    URLごとのレスポンスのキャッシュ
+
+    メモリ上には最近使った`max_entries`件を残し、`disk_path`を指定するとディスクにも保存して次の実行でも使う。
+    ディスクでは使ったエントリーの更新時刻を新しくし、合計が`max_size`バイトを超えたら最後に使ったのが古い順に消す。
+    サーバーが`Cache-Control: max-age`を返した場合はその秒数、それ以外は`ttl`秒の間は新しいものとして扱う。
+    古くなったエントリーもETag/Last-Modifiedでの条件付きリクエストに使える。
+    """
+
+    def __init__(self, ttl: float = 60, max_entries: int = 64, disk_path: Optional[str] = None,
+                 max_size: int = 100 * 1024 * 1024) -> None:
+        """
+            :param ttl: `Cache-Control: max-age`が無いレスポンスを新しいとみなす秒数
+            :param max_entries: メモリ上に残すエントリー数
+            :param disk_path: ディスク上の保存先のディレクトリ（Noneならメモリ上だけ）
+            :param max_size: ディスク上のエントリーの合計サイズの上限（バイト数）
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.disk_path = disk_path or None
+        self.max_size = max_size
+        self._entries: 'OrderedDict[str, CachedResponse]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        # ディスク上の合計サイズ（最初に書き込むときにディレクトリを調べ、以降は書き込んだ分を足す）
+        self._disk_size: Optional[int] = None
+
+    def _diskPath(self, url: str) -> str:
+        return os.path.join(self.disk_path or '', hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+                return entry
+        if self.disk_path is None or not os.path.exists(self._diskPath(url)):
+            return None
+        try:
+            with io.open(self._diskPath(url), encoding='utf-8') as fh:
+                entry = CachedResponse(**json.load(fh))
+            lru.touch(self._diskPath(url))
+        except (OSError, ValueError, TypeError):
+            logger.warning('broken http cache, ignore it: ' + url)
+            return None
+        self._remember(entry)
+        return entry
+
+    def put(self, entry: CachedResponse) -> None:
+        self._remember(entry)
+        if self.disk_path is None:
+            return
+        os.makedirs(self.disk_path, exist_ok=True)
+        path = self._diskPath(entry.url)
+        tmp_path = path + '.%d.tmp' % threading.get_ident()
+        with io.open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(entry._asdict(), fh, ensure_ascii=False)
+        with self._disk_lock:
+            if self._disk_size is None:
+                self._disk_size = sum(size for _, size, _ in lru.listFiles(self.disk_path, ['.json']))
+            if os.path.exists(path):
+                self._disk_size -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self._disk_size += os.path.getsize(path)
+            if self._disk_size > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        removed_list, self._disk_size = lru.evict(self.disk_path or '', ['.json'], self.max_size)
+        if removed_list:
+            logger.info('evict %d responses from http cache' % len(removed_list))
+
+    def _remember(self, entry: CachedResponse) -> None:
+        with self._lock:
+            self._entries[entry.url] = entry
+            self._entries.move_to_end(entry.url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def isFresh(self, entry: CachedResponse) -> bool:
+        max_age = self.ttl if entry.max_age is None else entry.max_age
+        return time.time() - entry.fetched_at < max_age
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def openResponseCache(config: Any) -> ResponseCache:
+    """設定ファイルの`[http_cache]`からレスポンスのキャッシュを作る"""
+    return ResponseCache(
+        ttl=config.getfloat('http_cache', 'ttl', fallback=60),
+        max_entries=config.getint('http_cache', 'max_entries', fallback=64),
+        disk_path=config.get('http_cache', 'disk_path', fallback='') or None,
+        max_size=int(config.getfloat('http_cache', 'max_size', fallback=100) * 1024 * 1024),
+    )
@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+from PIL import Image
+from typing import Any, List, Optional
+import lru
+import metrics
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def _encode(value: Any) -> Any:
+    """`json.dumps`で扱えない値（`__slots__`のオブジェクトやnumpyの数値）をJSONにできる形にする"""
+    if hasattr(value, '__slots__'):
+        return [getattr(value, name) for name in value.__slots__]
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def fileDigest(path: str) -> str:
+    """
+    ファイルの中身のsha256（無ければ`FileNotFoundError`）
+
+    無いファイルを空文字列などにすると、作業ディレクトリを間違えたときにテンプレートが変わっても同じキーになってしまう。
+    """
+    with open(path, 'rb') as fh:
+        return hashlib.sha256(fh.read()).hexdigest()
+
+
+class ImageCache():
+    """
+    描画した画像を、描画に使った入力のハッシュをキーにして保存しておくディスク上のキャッシュ
+
+    再実行や同じコンテストの重複したジョブで入力が同じなら、ブラウザや描画を飛ばして保存済みのPNGを使う。
+    入力には描画に使ったコードとテンプレートのハッシュも含めるので、それらが変わると別のキーになる。
+    使った画像の更新時刻を新しくし、合計が`max_size`バイトを超えたら最後に使ったのが古い順に消す。
+    """
+
+    def __init__(self, path: Optional[str] = 'tmp/render_cache', max_size: int = 50 * 1024 * 1024) -> None:
+        """
+            :param path: 保存先のディレクトリ（Noneならキャッシュしない）
+            :param max_size: 保存する画像の合計サイズの上限（バイト数）
+        """
+        self.path = path or None
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def key(self, kind: str, source_path_list: List[str], *inputs: Any) -> str:
+        """
+        描画の入力からキーを作る
+            :param kind: 画像の種類（`result`など）
+            :param source_path_list: 描画に使うコード・テンプレートのファイル
+            :param inputs: 描画に使うデータ（JSONにできるもの、`__slots__`のオブジェクトはその属性）
+        """
+        data = json.dumps([kind, [fileDigest(path) for path in source_path_list], list(inputs)],
+                          default=_encode, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _imagePath(self, key: str) -> str:
+        return os.path.join(self.path or '', key[:2], key + '.png')
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        if self.path is None or not os.path.exists(self._imagePath(key)):
+            return None
+        try:
+            with Image.open(self._imagePath(key)) as image:
+                image.load()
+                cached = image.convert('RGB')
+            lru.touch(self._imagePath(key))
+        except (OSError, ValueError):
+            logger.warning('broken render cache, ignore it: ' + key)
+            return None
+        metrics.count('render_cache_hits')
+        return cached
+
+    def put(self, key: str, image: Image.Image) -> None:
+        if self.path is None:
+            return
+        image_path = self._imagePath(key)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        tmp_path = image_path + '.%d.tmp' % threading.get_ident()
+        image.save(tmp_path, format='PNG')
+        os.replace(tmp_path, image_path)
+        with self._lock:
+            self._evict()
+
+    def _evict(self) -> None:
+        removed_list, _ = lru.evict(self.path or '', ['.png'], self.max_size)
+        if removed_list:
+            logger.info('evict %d images from render cache' % len(removed_list))
+
+
+def openImageCache(config: Any) -> ImageCache:
+    """設定ファイルの`[render_cache]`から描画した画像のキャッシュを作る"""
+    return ImageCache(
+        path=config.get('render_cache', 'path', fallback='tmp/render_cache') or None,
+        max_size=int(config.getfloat('render_cache', 'max_size', fallback=50) * 1024 * 1024),
+    )
@@ -0,0 +1,56 @@
+import os
+import time
+import logging
+from typing import List, Optional, Sequence, Tuple
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# ディスク上のキャッシュ（`archive.py`・`httpcache.py`・`imagecache.py`）で共通の、更新時刻を最後に使った時刻とみなすLRU
+
+
+def touch(path: str) -> None:
+    """ファイルを使ったことを記録する（更新時刻を新しくし、最後に使ったのが古い順に消すときに後回しにする）"""
+    os.utime(path)
+
+
+def listFiles(path: str, suffix_list: Sequence[str]) -> List[Tuple[float, int, str]]:
+    """
+    ディレクトリ以下のファイルを最後に使ったのが古い順に返す
+        :param path: ディレクトリ
+        :param suffix_list: 対象にするファイルの拡張子（ex: `['.png']`）
+        :return: (更新時刻, バイト数, パス)のリスト
+    """
+    file_list = []
+    for directory, _, name_list in os.walk(path):
+        for name in name_list:
+            if name.endswith(tuple(suffix_list)):
+                file_path = os.path.join(directory, name)
+                stat = os.stat(file_path)
+                file_list.append((stat.st_mtime, stat.st_size, file_path))
+    file_list.sort()
+    return file_list
+
+
+def evict(path: str,
+          suffix_list: Sequence[str],
+          max_size: int,
+          max_age: Optional[float] = None) -> Tuple[List[str], int]:
+    """
+    合計が`max_size`バイトを超えた分と`max_age`秒より前に使ったファイルを、最後に使ったのが古い順に消す
+        :param path: ディレクトリ
+        :param suffix_list: 対象にするファイルの拡張子
+        :param max_size: 合計サイズの上限（バイト数）
+        :param max_age: ファイルを残しておく秒数（Noneなら期限なし）
+        :return: (消したファイルのパスのリスト, 残ったファイルの合計バイト数)
+    """
+    file_list = listFiles(path, suffix_list)
+    total_size = sum(size for _, size, _ in file_list)
+    expire = -float('inf') if max_age is None else time.time() - max_age
+    removed_list = []
+    for mtime, size, file_path in file_list:
+        if mtime >= expire and total_size <= max_size:
+            break
+        os.remove(file_path)
+        total_size -= size
+        removed_list.append(file_path)
+    return removed_list, total_size
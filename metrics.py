@@ -0,0 +1,180 @@
+import os
+import io
+import json
+import time
+import threading
+import contextlib
+import contextvars
+import logging
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# `sendMessage.py`からも読み込まれるので標準ライブラリ以外は使わない
+
+
+def peakRss() -> int:
+    """
+    このプロセスのピーク時のRSS（バイト、取得できない環境では0）
+
+    プロセスが始まってからの最大値なので、デーモンの中で計った値は過去の実行も含めたプロセス全体のピークになる。
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    import sys
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxはキロバイト、macOSはバイトで返ってくる
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Tracer():
+    """
+    `generate.py`の各段階の所要時間とリソース使用量を記録する
+
+    1回の実行ごとに`begin`から`end`までのイベント（段階・スパン・集計）をJSON Linesで`path`に追記し、
+    `end`で段階ごとの所要時間とカウンターの集計をログに出す。
+    `begin`していない間もカウンターは数えるが、ファイルには何も書かない。
+    デーモンでは実行が重なることがあるので、実行ごとに`run`で新しく作り、`span`などは`current`から引く。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._file: Optional[Any] = None
+        self.run_id: Optional[str] = None
+        self._begin = time.perf_counter()
+        self._counters: Dict[str, int] = {}
+        self._spans: Dict[str, List[float]] = {}
+        self._stage: Optional[str] = None
+        self._stage_begin = 0.0
+
+    def emit(self, event: str, **fields: Any) -> None:
+        record = dict(run=self.run_id, event=event, time=time.time(), **fields)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                self._file.flush()
+
+    def begin(self, path: Optional[str] = None, **attrs: Any) -> None:
+        """
+        実行の記録を始める
+            :param path: JSON Linesを追記するファイル（Noneならファイルには書かない）
+            :param attrs: 実行の情報（コンテストなど）
+        """
+        with self._lock:
+            self.run_id = '%s-%d' % (time.strftime('%Y%m%d%H%M%S'), os.getpid())
+            self._begin = time.perf_counter()
+            self._counters = {}
+            self._spans = {}
+            self._stage = None
+            if path is not None:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                self._file = io.open(path, 'a', encoding='utf-8')
+        self.emit('begin', **attrs)
+
+    def stage(self, name: str) -> None:
+        """前の段階を終えて次の段階を始める"""
+        self._endStage()
+        self._stage = name
+        self._stage_begin = time.perf_counter()
+
+    def _endStage(self) -> None:
+        if self._stage is None:
+            return
+        self._record('stage', self._stage, time.perf_counter() - self._stage_begin)
+        self._stage = None
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """`with`の中の処理の時間を計る"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record('span', name, time.perf_counter() - start)
+
+    def _record(self, event: str, name: str, elapsed: float) -> None:
+        with self._lock:
+            self._spans.setdefault(name, []).append(elapsed)
+        self.emit(event, name=name, elapsed=elapsed, process_peak_rss=peakRss())
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'elapsed': time.perf_counter() - self._begin,
+                'spans': {name: {'count': len(elapsed_list), 'total': sum(elapsed_list), 'max': max(elapsed_list)}
+                          for name, elapsed_list in self._spans.items()},
+                'counters': dict(self._counters),
+                'process_peak_rss': peakRss(),
+            }
+
+    def end(self) -> Dict[str, Any]:
+        """実行の記録を終え、集計を書き出してログに出す"""
+        self._endStage()
+        summary = self.summary()
+        self.emit('summary', **summary)
+        logger.info('total %.2f s, process peak rss %.1f MB'
+                    % (summary['elapsed'], summary['process_peak_rss'] / 1024 / 1024))
+        for name, span in sorted(summary['spans'].items(), key=lambda item: -item[1]['total']):
+            logger.info('  %-24s %8.2f s (%d times)' % (name, span['total'], span['count']))
+        for name, value in sorted(summary['counters'].items()):
+            logger.info('  %-24s %8d' % (name, value))
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        return summary
+
+
+# 実行していない間（`run`の外）の計測先
+_idle_tracer = Tracer()
+_current: 'contextvars.ContextVar[Tracer]' = contextvars.ContextVar('tracer', default=_idle_tracer)
+
+
+def current() -> Tracer:
+    """今の実行の計測先（`run`の外では記録しないもの）"""
+    return _current.get()
+
+
+def attach(tracer: Tracer) -> None:
+    """
+    このスレッドの計測先を設定する（スレッドプールには`contextvars`が引き継がれないので`initializer`に渡す）
+        :param tracer: 計測先（`current()`で取ったもの）
+    """
+    _current.set(tracer)
+
+
+@contextlib.contextmanager
+def run(path: Optional[str] = None, **attrs: Any) -> Iterator[Tracer]:
+    """
+    実行ごとに新しい計測先を作り、`with`の中の`span`・`stage`・`count`をそこに記録する
+        :param path: JSON Linesを追記するファイル（Noneならファイルには書かない）
+        :param attrs: 実行の情報（コンテストなど）
+    """
+    tracer = Tracer()
+    token = _current.set(tracer)
+    tracer.begin(path, **attrs)
+    try:
+        yield tracer
+    finally:
+        tracer.end()
+        _current.reset(token)
+
+
+def span(name: str) -> ContextManager[None]:
+    """`with`の中の処理の時間を今の実行に記録する"""
+    return current().span(name)
+
+
+def stage(name: str) -> None:
+    """今の実行の前の段階を終えて次の段階を始める"""
+    current().stage(name)
+
+
+def count(name: str, value: int = 1) -> None:
+    current().count(name, value)
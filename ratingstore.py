@@ -0,0 +1,183 @@
+import os
+import io
+import json
+import logging
+import numpy as np
+from typing import Dict, Iterable, List, Sequence, Tuple
+import history
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 1行が1ユーザーの1コンテスト（列ごとに連続したメモリに並ぶように(列数, 行数)の配列で持つ）
+COLUMNS = ['user', 'contest', 'time', 'rating', 'rank']
+USER, CONTEST, TIME, RATING, RANK = range(len(COLUMNS))
+
+
+class RatingStore():
+    """
+    全ユーザーのレーティング履歴を列ごとのNumPyの配列で持つ保存先
+
+    `columns.npy`に(列数, 行数)のint64の配列を、`names.json`にユーザー名とコンテスト名を保存する。
+    行はユーザー・時刻の順に並べておき、読み込みはメモリマップなので何年分の履歴でも一瞬で開ける。
+    ユーザーとコンテストは`names.json`の添字で表し、名前は追記しかしないので配列より先に保存すれば壊れない。
+    集計は全てチームのユーザーの行を取り出してからベクトル演算で行う。
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+            :param path: 保存先のディレクトリ
+        """
+        self.path = path
+        self.user_names: List[str] = []
+        self.contest_names: List[str] = []
+        self.data = np.zeros((len(COLUMNS), 0), dtype=np.int64)
+        if os.path.exists(os.path.join(path, 'columns.npy')):
+            with io.open(os.path.join(path, 'names.json'), encoding='utf-8') as fh:
+                names = json.load(fh)
+            self.user_names, self.contest_names = names['users'], names['contests']
+            self.data = np.load(os.path.join(path, 'columns.npy'), mmap_mode='r')
+        self._user_id = {name: i for i, name in enumerate(self.user_names)}
+        self._contest_id = {name: i for i, name in enumerate(self.contest_names)}
+
+    def __len__(self) -> int:
+        return self.data.shape[1]
+
+    def _id(self, table: Dict[str, int], names: List[str], name: str) -> int:
+        if name not in table:
+            table[name] = len(names)
+            names.append(name)
+        return table[name]
+
+    def update(self, rating_history_list: Iterable[Tuple[str, history.RatingHistory]]) -> int:
+        """
+        レーティング履歴を取り込む（保存済みの行数と履歴の長さが違うユーザーだけ置き換える）
+            :param rating_history_list: (ユーザー名, レーティング履歴)のリスト
+            :return: 置き換えたユーザーの数
+        """
+        count = np.bincount(self.data[USER], minlength=len(self.user_names))
+        replaced_id_list = []
+        block_list = []
+        for name, rating_history in rating_history_list:
+            user_id = self._user_id.get(name)
+            if not rating_history or (user_id is not None and count[user_id] == len(rating_history)):
+                continue
+            user_id = self._id(self._user_id, self.user_names, name)
+            replaced_id_list.append(user_id)
+            block_list.append(np.array([
+                [user_id, self._id(self._contest_id, self.contest_names, str(h.get('ContestName', ''))),
+                 int(h['EndTime']), int(h['NewRating']), int(h.get('Place', 0))]
+                for h in rating_history
+            ], dtype=np.int64).T)
+        if not replaced_id_list:
+            return 0
+        data = np.concatenate([self.data[:, ~np.isin(self.data[USER], replaced_id_list)]] + block_list, axis=1)
+        self.data = data[:, np.lexsort((data[TIME], data[USER]))]
+        return len(replaced_id_list)
+
+    def save(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        names_path = os.path.join(self.path, 'names.json')
+        with io.open(names_path + '.tmp', 'w', encoding='utf-8') as fh:
+            json.dump({'users': self.user_names, 'contests': self.contest_names}, fh, ensure_ascii=False)
+        os.replace(names_path + '.tmp', names_path)
+        columns_path = os.path.join(self.path, 'columns.npy')
+        with open(columns_path + '.tmp', 'wb') as fh:
+            np.save(fh, np.ascontiguousarray(self.data))
+        os.replace(columns_path + '.tmp', columns_path)
+
+    # 集計
+
+    def _memberRows(self, name_list: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        チームのユーザーの行（ユーザー・時刻順）と、ユーザーのidからチーム内の番号への対応
+            :return: (行の添字, 対応表（チームに居ないユーザーは-1）)
+        """
+        member = np.full(len(self.user_names), -1, dtype=np.int64)
+        for i, name in enumerate(name_list):
+            if name in self._user_id:
+                member[self._user_id[name]] = i
+        # 行はユーザー順なので、ユーザーごとの行の範囲は二分探索で分かる（全行を走査しない）
+        user_id_list = np.flatnonzero(member >= 0)
+        begin = np.searchsorted(self.data[USER], user_id_list, side='left')
+        length = np.searchsorted(self.data[USER], user_id_list, side='right') - begin
+        offset = np.repeat(begin - (np.cumsum(length) - length), length)
+        return np.arange(length.sum()) + offset, member
+
+    def ratingAt(self, name_list: Sequence[str], time: float = np.inf) -> np.ndarray:
+        """
+        各ユーザーの`time`時点のレーティング
+            :param name_list: ユーザー名のリスト
+            :param time: UNIX時間（省略した場合は最新）
+            :return: `name_list`の順番のレーティング（まだ参加していなければNaN）
+        """
+        rows, member = self._memberRows(name_list)
+        rows = rows[self.data[TIME, rows] <= time]
+        rating = np.full(len(name_list), np.nan)
+        if len(rows) == 0:
+            return rating
+        user = self.data[USER, rows]
+        # 行はユーザー・時刻順なので、ユーザーごとの最後の行がその時点のレーティング
+        last = np.r_[user[1:] != user[:-1], True]
+        rating[member[user[last]]] = self.data[RATING, rows[last]]
+        return rating
+
+    def averageTimeline(self, name_list: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        チームの平均レーティングの推移（その時点で参加したことのあるユーザーの平均）
+            :param name_list: チームのユーザー名のリスト
+            :return: (チームの誰かが参加したコンテストの終了時刻, その時点の平均レーティング)
+        """
+        rows, _ = self._memberRows(name_list)
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        user, time, rating = self.data[USER, rows], self.data[TIME, rows], self.data[RATING, rows]
+        # 各行をチームのレーティングの合計の変化量（初参加ならレーティング、それ以外は前回からの差）にして、時刻順に累積する
+        is_first = np.r_[True, user[1:] != user[:-1]]
+        delta = np.where(is_first, rating, rating - np.r_[0, rating[:-1]])
+        order = np.argsort(time, kind='stable')
+        total, member_count = np.cumsum(delta[order]), np.cumsum(is_first[order])
+        time = time[order]
+        last = np.r_[time[1:] != time[:-1], True]
+        return time[last], total[last] / member_count[last]
+
+    def percentiles(self, name_list: Sequence[str], q: Sequence[float], time: float = np.inf) -> np.ndarray:
+        """チームのレーティングの分位点（参加したことのないユーザーは除く、誰も居なければNaN）"""
+        rating = self.ratingAt(name_list, time)
+        rating = rating[~np.isnan(rating)]
+        if len(rating) == 0:
+            return np.full(len(q), np.nan)
+        return np.percentile(rating, q)
+
+    def biggestMovers(self, name_list: Sequence[str], since: float, n: int = 3) -> List[Tuple[str, int, int]]:
+        """
+        `since`からレーティングが大きく変わったユーザー
+            :param name_list: チームのユーザー名のリスト
+            :param since: UNIX時間
+            :param n: 返すユーザーの数
+            :return: 変化の大きい順の(ユーザー名, 変化前, 変化後)のリスト（`since`より前に参加していないユーザーは除く）
+        """
+        before, after = self.ratingAt(name_list, since), self.ratingAt(name_list)
+        diff = after - before
+        index_list = np.flatnonzero(~np.isnan(diff) & (diff != 0))
+        index_list = index_list[np.argsort(-np.abs(diff[index_list]), kind='stable')][:n]
+        return [(name_list[i], int(before[i]), int(after[i])) for i in index_list]
+
+    def streaks(self, name_list: Sequence[str]) -> np.ndarray:
+        """
+        各ユーザーの直近のレーティングの連続上昇（正）・連続下降（負）の回数
+            :param name_list: ユーザー名のリスト
+            :return: `name_list`の順番の回数（参加2回未満や直近で変化なしなら0）
+        """
+        rows, member = self._memberRows(name_list)
+        streak = np.zeros(len(name_list), dtype=np.int64)
+        if len(rows) == 0:
+            return streak
+        user, rating = self.data[USER, rows], self.data[RATING, rows]
+        is_first = np.r_[True, user[1:] != user[:-1]]
+        sign = np.where(is_first, 0, np.sign(np.r_[0, np.diff(rating)]))
+        # ユーザーか変化の向きが変わったところで区切り、ユーザーごとの最後の区間の長さを数える
+        run_id = np.cumsum(is_first | np.r_[True, sign[1:] != sign[:-1]]) - 1
+        run_length = np.bincount(run_id)
+        last = np.r_[user[1:] != user[:-1], True]
+        streak[member[user[last]]] = sign[last] * run_length[run_id[last]]
+        return streak
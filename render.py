@@ -0,0 +1,421 @@
+import os
+import threading
+import datetime as dt
+import logging
+import viewmodel
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Bootstrap 4の`table-dark`の見た目に合わせる
+BACKGROUND_COLOR = '#ffffff'
+TABLE_COLOR = '#212529'
+BORDER_COLOR = '#32383e'
+TEXT_COLOR = '#ffffff'
+HEADING_COLOR = '#212529'
+FONT_SIZE = 16
+CELL_PADDING = 12
+
+# 日本語のコンテスト名を描画するためにCJKフォントを優先して探す
+FONT_PATH_CANDIDATES = [
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/fonts-japanese-gothic.ttf',
+    '/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+]
+BOLD_FONT_PATH_CANDIDATES = [
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Bold.ttc',
+    '/System/Library/Fonts/ヒラギノ角ゴシック W6.ttc',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+]
+
+# セル内の文字列が`CHECK`のときはフォントに頼らずチェックマークを描く
+CHECK = '✔︎'
+
+font_path: Optional[str] = None
+bold_font_path: Optional[str] = None
+# FreeTypeのフォントは複数のスレッドから同時に使えないので、スレッドごとに読み込む
+_font_cache: Dict[Tuple[int, bool, int], Any] = {}
+
+
+class Run(NamedTuple):
+    """セル内の同じ色で描画される文字列"""
+    text: str
+    color: str = TEXT_COLOR
+
+
+Cell = List[Run]
+
+
+def setFont(path: Optional[str] = None, bold_path: Optional[str] = None) -> None:
+    global font_path, bold_font_path
+    font_path = path or None
+    bold_font_path = bold_path or path or None
+    _font_cache.clear()
+
+
+def loadFont(size: int = FONT_SIZE, bold: bool = False) -> Any:
+    key = (size, bold, threading.get_ident())
+    if key in _font_cache:
+        return _font_cache[key]
+    configured = bold_font_path if bold else font_path
+    candidates = ([configured] if configured else []) + \
+        (BOLD_FONT_PATH_CANDIDATES if bold else []) + FONT_PATH_CANDIDATES
+    font: Any = None
+    for path in candidates:
+        if os.path.exists(path):
+            font = ImageFont.truetype(path, size)
+            break
+    if font is None:
+        logger.warning('no truetype font found, use default bitmap font')
+        font = ImageFont.load_default()
+    _font_cache[key] = font
+    return font
+
+
+def textWidth(font: Any, text: str) -> int:
+    if text == CHECK:
+        return int(font.size * 0.9) if hasattr(font, 'size') else 10
+    if hasattr(font, 'getlength'):
+        return int(round(font.getlength(text)))
+    return font.getsize(text)[0]
+
+
+def lineHeight(font: Any) -> int:
+    return int(getattr(font, 'size', 11) * 1.5)
+
+
+def cellWidth(font: Any, cell: Cell) -> int:
+    return sum(textWidth(font, run.text) for run in cell)
+
+
+def drawCheck(draw: Any, x: int, y: int, size: int, color: str) -> None:
+    points = [
+        (x + size * 0.1, y + size * 0.55),
+        (x + size * 0.4, y + size * 0.85),
+        (x + size * 0.9, y + size * 0.2),
+    ]
+    draw.line(points, fill=color, width=max(2, size // 8))
+
+
+def drawCell(draw: Any, x: int, y: int, font: Any, cell: Cell) -> None:
+    height = lineHeight(font)
+    for run in cell:
+        if run.text == CHECK:
+            size = textWidth(font, CHECK)
+            drawCheck(draw, x, y + (height - size) // 2, size, run.color)
+        else:
+            draw.text((x, y + (height - getattr(font, 'size', 11)) // 2 - 2), run.text, font=font, fill=run.color)
+        x += textWidth(font, run.text)
+
+
+def measureTable(header: List[Cell], rows: List[List[Cell]], min_width: int = 0) -> Tuple[List[int], int, int]:
+    """
+    表の各列の幅と表全体の幅・高さを計算する（ブラウザの自動レイアウトと同じく内容に合わせて広げる）
+        :return: (列幅のリスト, 幅, 高さ)
+    """
+    font, bold_font = loadFont(), loadFont(bold=True)
+    column_width_list = [cellWidth(bold_font, cell) + CELL_PADDING * 2 for cell in header]
+    for row in rows:
+        for i, cell in enumerate(row):
+            column_width_list[i] = max(column_width_list[i], cellWidth(font, cell) + CELL_PADDING * 2)
+    width = sum(column_width_list)
+    if width < min_width:
+        # 余った幅は各列に均等に割り振る
+        extra = min_width - width
+        column_width_list = [
+            w + extra // len(column_width_list) + (1 if i < extra % len(column_width_list) else 0)
+            for i, w in enumerate(column_width_list)]
+        width = min_width
+    row_height = lineHeight(font) + CELL_PADDING * 2
+    return column_width_list, width, row_height * (len(rows) + 1) + 1
+
+
+def drawTable(image: Image.Image,
+              x: int,
+              y: int,
+              header: List[Cell],
+              rows: List[List[Cell]],
+              min_width: int = 0) -> Tuple[int, int]:
+    """
+    `(x, y)`を左上として表を描画する
+        :param header: ヘッダーのセルのリスト（太字で描画する）
+        :param rows: 行のリスト
+        :param min_width: 表の最小幅
+        :return: 描画した表の(幅, 高さ)
+    """
+    font, bold_font = loadFont(), loadFont(bold=True)
+    column_width_list, width, height = measureTable(header, rows, min_width)
+    row_height = lineHeight(font) + CELL_PADDING * 2
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((x, y, x + width - 1, y + height - 1), fill=TABLE_COLOR)
+    for r, row in enumerate([header] + rows):
+        top = y + r * row_height
+        left = x
+        if r > 0:
+            draw.line((x, top, x + width - 1, top), fill=BORDER_COLOR, width=2 if r == 1 else 1)
+        for i, cell in enumerate(row):
+            # 1列目（順位）はヘッダーと同じく太字
+            drawCell(draw, left + CELL_PADDING, top + CELL_PADDING,
+                     bold_font if r == 0 or i == 0 else font, cell)
+            left += column_width_list[i]
+    return width, height
+
+
+def drawHeading(image: Image.Image, center_x: int, y: int, text: str, size: int) -> int:
+    font = loadFont(size, bold=True)
+    draw = ImageDraw.Draw(image)
+    draw.text((center_x - textWidth(font, text) // 2, y), text, font=font, fill=HEADING_COLOR)
+    return lineHeight(font)
+
+
+def renderResult(result_table_list: List[viewmodel.ResultTable], width: int = 940) -> Image.Image:
+    """
+    `tpl/result.tpl.html`と同じレイアウトのコンテスト結果の表を描画する
+        :param result_table_list: コンテストごとの表（`viewmodel.buildResultTableList`）
+        :return: 表の画像
+    """
+    table_list = []
+    for result_table in result_table_list:
+        header = [[Run(title)] for title in ['Rank', 'Name', 'Score'] + result_table.problem_list]
+        rows = [
+            [
+                [Run(str(row.rank) + ' (' + str(row.global_rank) + ')')],
+                [Run(row.name, row.color or TEXT_COLOR)],
+                [Run(row.score)],
+            ] + [[Run(CHECK if is_correct else '-')] for is_correct in row.points]
+            for row in result_table.row_list
+        ]
+        table_list.append((result_table.title, header, rows))
+
+    margin = 8
+    h1_size, h2_size = 40, 32
+    height = margin + lineHeight(loadFont(h1_size, bold=True)) + 8
+    for title, header, rows in table_list:
+        _, table_width, table_height = measureTable(header, rows, 500)
+        width = max(width, table_width + margin * 2)
+        height += lineHeight(loadFont(h2_size, bold=True)) + 8 + table_height + 16
+    height += margin
+
+    image = Image.new('RGB', (width, height), BACKGROUND_COLOR)
+    y = margin
+    y += drawHeading(image, width // 2, y, 'Contests', h1_size) + 8
+    for title, header, rows in table_list:
+        y += drawHeading(image, width // 2, y, title, h2_size) + 8
+        _, table_width, _ = measureTable(header, rows, 500)
+        _, table_height = drawTable(image, (width - table_width) // 2, y, header, rows, 500)
+        y += table_height + 16
+    return image
+
+
+def renderRating(rating_row_list: List[viewmodel.RatingRow], width: int = 640) -> Image.Image:
+    """
+    `tpl/rating.tpl.html`と同じレイアウトのレーティングの表を描画する
+        :param rating_row_list: 表の行（`viewmodel.buildRatingRowList`）
+        :return: 表の画像
+    """
+    header = [[Run('Rank')], [Run('')], [Run('User')], [Run('Rating')]]
+    rows = []
+    for row in rating_row_list:
+        rank_diff, rating_diff = row.rank_diff, row.rating_diff
+        rank_cell = [Run('→', 'gray')] if rank_diff == 0 else \
+            [Run('↑' + str(rank_diff), 'green')] if rank_diff > 0 else [Run('↓' + str(-rank_diff), 'red')]
+        rating_cell = [Run(str(row.rating))] + (
+            [] if rating_diff == 0 else
+            [Run('('), Run('+' + str(rating_diff), 'green'), Run(')')] if rating_diff > 0 else
+            [Run('('), Run('-' + str(-rating_diff), 'red'), Run(')')])
+        rows.append([
+            [Run(str(row.rank))],
+            rank_cell,
+            [Run(row.name, row.color)],
+            rating_cell,
+        ])
+
+    margin_top = 50
+    _, table_width, table_height = measureTable(header, rows, 500)
+    width = max(width, table_width)
+    image = Image.new('RGB', (width, margin_top + table_height + 16), BACKGROUND_COLOR)
+    drawTable(image, (width - table_width) // 2, margin_top, header, rows, 500)
+    return image
+
+
+# `chart/chart.js`と同じ配色・レイアウトでレーティングチャートを描く
+CHART_WIDTH = 640
+CHART_HEIGHT = 360
+CHART_OFFSET_X = 50
+CHART_OFFSET_Y = 5
+CHART_PANEL_WIDTH = CHART_WIDTH - CHART_OFFSET_X - 10
+CHART_PANEL_HEIGHT = CHART_HEIGHT - CHART_OFFSET_Y - 30
+# 以前のスクリーンショット（700x400で切り抜いていた）と同じ余白を付ける
+CHART_MARGIN = (8, 22, 52, 18)
+CHART_SCALE = 2
+RATE_STEP = 400
+RATE_COLORS = [
+    (0, '#808080'),
+    (400, '#804000'),
+    (800, '#008000'),
+    (1200, '#00C0C0'),
+    (1600, '#0000FF'),
+    (2000, '#C0C000'),
+    (2400, '#FF8000'),
+    (2800, '#FF0000'),
+]
+MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+class ChartRange(NamedTuple):
+    """チャートの表示範囲（日時はUNIX時間）"""
+    date_begin: int
+    date_end: int
+    rate_min: int
+    rate_max: int
+
+
+def rateColor(rating: int) -> str:
+    return RATE_COLORS[max(0, min(len(RATE_COLORS) - 1, rating // RATE_STEP))][1]
+
+
+def blend(color: str, alpha: float) -> Tuple[int, int, int]:
+    """白背景の上に`alpha`の透明度で`color`を塗ったときの色"""
+    r, g, b = ImageColor.getrgb(color)[:3]
+    return (int(255 + (r - 255) * alpha), int(255 + (g - 255) * alpha), int(255 + (b - 255) * alpha))
+
+
+def nextMonth(date: dt.datetime) -> dt.datetime:
+    return date.replace(year=date.year + date.month // 12, month=date.month % 12 + 1, day=1,
+                        hour=0, minute=0, second=0)
+
+
+def drawChartBackground(draw: Any, chart_range: ChartRange, convert: Callable[[float, float], Tuple[float, float]],
+                        font: Any) -> None:
+    s = CHART_SCALE
+    date_begin, date_end, rate_min, rate_max = chart_range
+    for rate, color in RATE_COLORS:
+        x0, y0 = convert(date_begin, rate + RATE_STEP)
+        x1, y1 = convert(date_end, rate)
+        top, bottom = max(y0, CHART_OFFSET_Y * s), min(y1, (CHART_OFFSET_Y + CHART_PANEL_HEIGHT) * s)
+        if top < bottom:
+            draw.rectangle((x0, top, x1, bottom), fill=blend(color, 0.3))
+    for rate, color in RATE_COLORS:
+        if not rate_min <= rate <= rate_max:
+            continue
+        x0, y = convert(date_begin, rate)
+        x1, _ = convert(date_end, rate)
+        draw.line((x0, y, x1, y), fill='#ffffff', width=1)
+        if rate != 0:
+            label = str(rate)
+            draw.text((x0 - 5 * s - textWidth(font, label), y - font.size // 2 - 2), label, font=font, fill='#000000')
+
+    # 縦軸はおおよそ24本以下になるように何ヶ月おきに引くか決める
+    month_step = max(1, int(-(-(date_end - date_begin) // (60 * 60 * 24 * 30 * 12 * 2))))
+    date = nextMonth(dt.datetime.fromtimestamp(date_begin))
+    first_month = date
+    while date.timestamp() <= date_end:
+        x, y0 = convert(date.timestamp(), rate_min)
+        _, y1 = convert(date.timestamp(), rate_max)
+        label = MONTH_NAMES[date.month - 1]
+        draw.text((x - textWidth(font, label) // 2, y0 + 3 * s), label, font=font, fill='#000000')
+        if date == first_month or date.month == 1:
+            label = str(date.year)
+            draw.text((x - textWidth(font, label) // 2, y0 + 18 * s), label, font=font, fill='#000000')
+        draw.line((x, y0, x, y1), fill='#ffffff', width=1)
+        for _ in range(month_step):
+            date = nextMonth(date)
+
+    draw.rectangle(
+        (CHART_OFFSET_X * s, CHART_OFFSET_Y * s,
+         (CHART_OFFSET_X + CHART_PANEL_WIDTH) * s, (CHART_OFFSET_Y + CHART_PANEL_HEIGHT) * s),
+        outline='#888888', width=int(1.5 * s))
+
+
+def drawUserChart(draw: Any,
+                  rating_history: List[Dict[str, Any]],
+                  user_name: str,
+                  chart_range: ChartRange,
+                  convert: Callable[[float, float], Tuple[float, float]],
+                  font: Any) -> None:
+    s = CHART_SCALE
+    point_list = [convert(rating['EndTime'], rating['NewRating']) for rating in rating_history]
+    if len(point_list) > 1:
+        draw.line(point_list, fill='#aaaaaa', width=2 * s, joint='curve')
+        draw.line(point_list, fill='#ffffff', width=max(1, s // 2))
+    for i, ((x, y), rating) in enumerate(zip(point_list, rating_history)):
+        r = 3.5 * s
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=rateColor(rating['NewRating']),
+                     outline='#000000' if i == len(point_list) - 1 else '#ffffff', width=max(1, s // 2))
+
+    # 最新のレートの近くにユーザー名を付ける
+    x, y = point_list[-1]
+    dx = -80 * s if (chart_range.date_begin + chart_range.date_end) / 2 < rating_history[-1]['EndTime'] else 80 * s
+    text_x, text_y = x + dx, y - 16 * s
+    label_width = textWidth(font, user_name) + 4 * s
+    draw.line((x, y, text_x, text_y), fill='#ffffff', width=max(1, s // 2))
+    draw.rectangle((text_x - label_width / 2, text_y - 10 * s, text_x + label_width / 2, text_y + 10 * s),
+                   fill='#ffffff', outline='#888888')
+    draw.text((text_x - textWidth(font, user_name) / 2, text_y - font.size / 2 - 2), user_name,
+              font=font, fill='#000000')
+
+
+def renderChartBand(user_chart_list: List[Tuple[str, List[Dict[str, Any]]]], chart_range: ChartRange) -> Image.Image:
+    """
+    1つのレート帯のチャートを描画する
+        :param user_chart_list: (ユーザー名, レーティング履歴)のリスト
+        :param chart_range: 表示範囲
+        :return: チャートの画像
+    """
+    s = CHART_SCALE
+    date_begin, date_end, rate_min, rate_max = chart_range
+    x_scale = CHART_PANEL_WIDTH * s / (date_end - date_begin)
+    y_scale = CHART_PANEL_HEIGHT * s / (rate_max - rate_min)
+
+    def convert(date: float, rate: float) -> Tuple[float, float]:
+        return ((CHART_OFFSET_X * s + (date - date_begin) * x_scale),
+                (CHART_OFFSET_Y * s + (rate_max - rate) * y_scale))
+
+    font = loadFont(12 * s)
+    image = Image.new('RGB', (CHART_WIDTH * s, CHART_HEIGHT * s), BACKGROUND_COLOR)
+    drawChartBackground(ImageDraw.Draw(image), chart_range, convert, font)
+
+    # パネルからはみ出した部分は切り取る
+    chart_layer = Image.new('RGBA', image.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(chart_layer)
+    for user_name, rating_history in user_chart_list:
+        if rating_history:
+            drawUserChart(draw, rating_history, user_name, chart_range, convert, font)
+    panel = (CHART_OFFSET_X * s, CHART_OFFSET_Y * s,
+             (CHART_OFFSET_X + CHART_PANEL_WIDTH) * s, (CHART_OFFSET_Y + CHART_PANEL_HEIGHT) * s)
+    image.paste(chart_layer.crop(panel), panel[:2], chart_layer.crop(panel))
+
+    image = image.resize((CHART_WIDTH, CHART_HEIGHT), Image.LANCZOS)  # type: ignore
+    left, top, right, bottom = CHART_MARGIN
+    framed = Image.new('RGB', (left + CHART_WIDTH + right, top + CHART_HEIGHT + bottom), BACKGROUND_COLOR)
+    framed.paste(image, (left, top))
+    return framed
+
+
+def renderChart(user_chart_list: List[Tuple[str, List[Dict[str, Any]]]],
+                chart_range_list: List[ChartRange],
+                executor: Optional[Executor] = None) -> Image.Image:
+    """
+    レート帯ごとのチャートを縦に並べて描画する
+        :param user_chart_list: (ユーザー名, レーティング履歴)のリスト
+        :param chart_range_list: レート帯ごとの表示範囲
+        :param executor: 指定した場合はレート帯ごとに並列に描画する
+        :return: チャートの画像
+    """
+    if executor is not None:
+        band_list = list(executor.map(lambda chart_range: renderChartBand(user_chart_list, chart_range),
+                                      chart_range_list))
+    else:
+        band_list = [renderChartBand(user_chart_list, chart_range) for chart_range in chart_range_list]
+    image = Image.new('RGB', (max(band.width for band in band_list), sum(band.height for band in band_list)),
+                      BACKGROUND_COLOR)
+    y = 0
+    for band in band_list:
+        image.paste(band, (0, y))
+        y += band.height
+    return image
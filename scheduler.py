@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+import heapq
+import asyncio
+import argparse
+import configparser
+import datetime as dt
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import check
+import slack
+import storage
+import teams
+from typing import Any, Dict, List, Set, Tuple
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 大きく遅れたリマインダー（daemonが止まっていた場合など）は投稿しても意味がないので捨てる
+MESSAGE_EXPIRE = dt.timedelta(minutes=10)
+# 他のプロセスが追加したジョブを拾うためにDBを読み直す間隔（秒）
+RELOAD_INTERVAL = 60
+# コンテスト結果の投稿は`at`と同じく別のプロセスで実行する
+GENERATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generate.py')
+GENERATE_LOG_PATH = 'log/generate.log'
+
+Job = Tuple[dt.datetime, int, str, Dict[str, Any]]
+
+
+class Scheduler():
+    """
+    `at`の代わりにリマインダーとコンテスト結果の投稿を実行する常駐プロセス
+
+    ジョブはDBの`job`テーブルに保存されているので再起動しても失われない。
+    実行時刻順のヒープで次のジョブまで眠り、リマインダーは同じプロセスの中で投稿する（`check.py`も定期的に実行する）。
+    `generate.py`はレーティング更新を最大2時間待ち、設定やキャッシュをモジュールの変数に置くので、ジョブごとに別のプロセスで並行して実行する。
+    """
+
+    def __init__(self,
+                 db: storage.Storage,
+                 Slack_list: List[slack.AsyncSlack],
+                 check_interval: float,
+                 mode: str = 'deployment') -> None:
+        self.db = db
+        self.Slack_list = Slack_list
+        self.check_interval = check_interval
+        self.mode = mode
+        self._heap: List[Job] = []
+        self._known: Set[int] = set()
+        self._tasks: Set[Any] = set()
+        # `check.main`専用（前回の`check.main`が終わっていなければ次は実行しない）
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._checking = False
+
+    def reload(self) -> None:
+        for job_id, run_at, kind, payload in self.db.readPendingJobList():
+            if job_id not in self._known:
+                self._known.add(job_id)
+                heapq.heappush(self._heap, (run_at, job_id, kind, payload))
+
+    def _spawn(self, coroutine: Any) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def dispatch(self, job: Job) -> None:
+        run_at, job_id, kind, payload = job
+        if self.db.readJobStatus(job_id) != 'pending':
+            # `check.py`がコンテストの変更で取り消したジョブ
+            logger.info('skip cancelled job %d (%s)' % (job_id, kind))
+            self._known.discard(job_id)
+            return
+        status = 'done'
+        try:
+            if kind == 'message':
+                if dt.datetime.now() - run_at > MESSAGE_EXPIRE:
+                    logger.info('expired job %d : %s' % (job_id, payload['text']))
+                    status = 'expired'
+                else:
+                    # リマインダーは全チームのチャンネルに投稿する
+                    await asyncio.gather(*[Slack.postCoalesced(payload['text'], run_at) for Slack in self.Slack_list])
+            elif kind == 'generate':
+                if await self.runGenerate(payload['contest_id_list']) != 0:
+                    status = 'failed'
+            else:
+                logger.error('unknown job kind : ' + kind)
+                status = 'failed'
+        except Exception:
+            logger.exception('job %d failed' % job_id)
+            status = 'failed'
+        self.db.updateJobStatus(job_id, status)
+        self._known.discard(job_id)
+        logger.info('job %d (%s) : %s' % (job_id, kind, status))
+
+    async def runGenerate(self, contest_id_list: List[str]) -> int:
+        """
+        `generate.py`を別のプロセスで実行して終わるまで待つ
+            :param contest_id_list: 同時に終わったコンテストのLinkのリスト
+            :return: 終了コード
+        """
+        os.makedirs(os.path.dirname(GENERATE_LOG_PATH), exist_ok=True)
+        with open(GENERATE_LOG_PATH, 'ab') as log:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, GENERATE_PATH, *contest_id_list, '--mode', self.mode,
+                stdout=log, stderr=asyncio.subprocess.STDOUT)
+            return await process.wait()
+
+    async def runCheck(self) -> None:
+        self._checking = True
+        try:
+            await asyncio.get_event_loop().run_in_executor(self._executor, check.main)
+        except Exception:
+            logger.exception('check failed')
+        finally:
+            self._checking = False
+        self.reload()
+
+    async def run(self) -> None:
+        next_check = time.monotonic()
+        next_reload = time.monotonic()
+        while True:
+            if time.monotonic() >= next_check:
+                if self._checking:
+                    logger.warning('previous check is still running, skip this check')
+                else:
+                    self._spawn(self.runCheck())
+                next_check = time.monotonic() + self.check_interval
+            if time.monotonic() >= next_reload:
+                self.reload()
+                next_reload = time.monotonic() + RELOAD_INTERVAL
+
+            now = dt.datetime.now()
+            while self._heap and self._heap[0][0] <= now:
+                job = heapq.heappop(self._heap)
+                logger.info('run job %d (%s)' % (job[1], job[2]))
+                self._spawn(self.dispatch(job))
+
+            wait = min(next_check, next_reload) - time.monotonic()
+            if self._heap:
+                wait = min(wait, (self._heap[0][0] - dt.datetime.now()).total_seconds())
+            await asyncio.sleep(max(0.0, wait))
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='deployment')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+
+    scheduler = Scheduler(
+        storage.openStorage(check.data_path),
+        teams.openSlackList(config, args.mode, slack.AsyncSlack),
+        check_interval=config.getfloat('scheduler', 'check_interval', fallback=60 * 5),
+        mode=args.mode,
+    )
+    asyncio.get_event_loop().run_until_complete(scheduler.run())
@@ -1,17 +1,13 @@
 import sys
 import configparser
 
-import util
-import slack
+import teams
 
 config = configparser.ConfigParser()
 config.read('config.ini')
 
-Slack = slack.Slack(
-    channel=config['slack']['channel_name'],
-    token=config['slack']['token']
-)
-
 message = sys.argv[1]
 
-Slack.post(message)
+# リマインダーは全チームのチャンネルに投稿する
+for Slack in teams.openSlackList(config):
+    Slack.post(message)
@@ -1,59 +1,315 @@
-import util
+import urllib.error
 import urllib.parse
-import requests
-from PIL import Image
-from IPython import embed
+import urllib.request
+import json
+import time
+import threading
+import functools
+import tempfile
 import logging
-import io
 import os
+import metrics
 from datetime import datetime
-from typing import Any
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+SLACK_API_URL = 'https://slack.com/api/'
+MAX_RETRY = 5
+
+
+# `auto`のときに試す順番（画質順ではない。見た目がほぼ変わらず小さい256色PNGを最初に、劣化のないフルカラーPNG、非可逆のWebP・JPEGの順）
+IMAGE_FORMAT_LIST = ['png-palette', 'png', 'webp', 'jpeg']
+IMAGE_FORMATS = {
+    # 名前: (Pillowのフォーマット, MIMEタイプ, 拡張子)
+    'png': ('png', 'image/png', 'png'),
+    'png-palette': ('png', 'image/png', 'png'),
+    'webp': ('webp', 'image/webp', 'webp'),
+    'jpeg': ('jpeg', 'image/jpeg', 'jpg'),
+}
+# これより大きい画像はエンコード結果をメモリではなく一時ファイルに置く（複数のフォーマットを試す間だけの節約で、
+# アップロードはrequestsがmultipartの本文をメモリ上に作るのでストリーミングにはならない）
+SPOOL_SIZE = 1024 * 1024
+
+
+class EncodedImage(NamedTuple):
+    """エンコード済みの画像"""
+    file: Any  # 先頭にシーク済みのファイルオブジェクト
+    format: str
+    mimetype: str
+    extension: str
+    size: int  # バイト数
+    elapsed: float  # エンコードにかかった秒数
+
+
+def encodeImage(image: Any, format: str = 'png') -> EncodedImage:
+    """
+    Pillowの画像を`format`でエンコードする
+        :param image: Pillowの画像
+        :param format: `IMAGE_FORMATS`のいずれか
+    """
+    pil_format, mimetype, extension = IMAGE_FORMATS[format]
+    start = time.perf_counter()
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    if format == 'png-palette':
+        # 表やチャートは使っている色が少ないので256色に減色しても見た目はほぼ変わらない
+        image.convert('RGB').quantize(256).save(file, format=pil_format, optimize=True)
+    elif format == 'png':
+        image.save(file, format=pil_format, optimize=True)
+    elif format == 'webp':
+        image.convert('RGB').save(file, format=pil_format, quality=90, method=4)
+    else:
+        image.convert('RGB').save(file, format=pil_format, quality=85, optimize=True)
+    size = file.tell()
+    file.seek(0)
+    return EncodedImage(file, format, mimetype, extension, size, time.perf_counter() - start)
+
+
+def encodeImageUnderBudget(image: Any, budget: int, format_list: List[str] = None) -> EncodedImage:
+    """
+    `format_list`の順に試し、最初に`budget`バイト以下になったエンコードを返す（どれも超えた場合は最も小さいもの）
+        :param image: Pillowの画像
+        :param budget: 画像サイズの上限（バイト）
+        :param format_list: 試すフォーマットのリスト
+    """
+    smallest: Optional[EncodedImage] = None
+    for format in format_list or IMAGE_FORMAT_LIST:
+        try:
+            encoded = encodeImage(image, format)
+        except (OSError, KeyError, ValueError):
+            # Pillowのビルドによっては使えないフォーマットがある
+            logger.warning('cannot encode image as ' + format)
+            continue
+        logger.info('encode image as %s : %d bytes, %.3f s' % (format, encoded.size, encoded.elapsed))
+        if encoded.size <= budget:
+            if smallest is not None:
+                smallest.file.close()
+            return encoded
+        if smallest is None or encoded.size < smallest.size:
+            if smallest is not None:
+                smallest.file.close()
+            smallest = encoded
+        else:
+            encoded.file.close()
+    if smallest is None:
+        raise ValueError('no available image format')
+    return smallest
+
+
+def _lowerHeaders(headers: Any) -> Dict[str, str]:
+    """HTTPヘッダーの名前は大文字小文字を区別しないので、小文字にそろえた辞書にする"""
+    return {str(name).lower(): str(value) for name, value in headers.items()}
+
+
+class SlackError(Exception):
+    """Slack APIが`ok: false`を返した"""
+    pass
+
+
+class TokenBucket():
+    """`rate`回/秒（最大`capacity`回まで連続）にリクエストを抑える"""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """トークンを1つ予約し、使えるようになるまでの秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
 
 class Slack():
     """SNS communication tool APIs"""
 
     def __init__(self,
                  channel: str,
-                 token: str
+                 token: str,
+                 api_url: str = SLACK_API_URL,
+                 image_format: str = 'auto',
+                 image_size_budget: int = 1024 * 1024
                  ) -> None:
         self.channel = channel
         self.token = token
+        self.api_url = api_url
+        self.image_format = image_format
+        self.image_size_budget = image_size_budget
+        self._session: Any = None
+
+    def _send(self, method: str, data: Dict[str, str], files: Dict[str, Any] = None) -> Tuple[int, Dict[str, str], bytes]:
+        """
+        APIを1回呼び出す
+            :return: (ステータスコード, ヘッダー（名前は小文字にそろえる）, 本文)
+        """
+        if files is None:
+            # リマインダーはこれだけのためにプロセスを起動するので、requestsを読み込まずに標準ライブラリで投稿する
+            request = urllib.request.Request(self.api_url + method, urllib.parse.urlencode(data).encode('utf-8'))
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    return response.status, _lowerHeaders(response.headers), response.read()
+            except urllib.error.HTTPError as e:
+                return e.code, _lowerHeaders(e.headers), e.read()
+        import requests
+        if self._session is None:
+            self._session = requests.Session()
+        response = self._session.post(self.api_url + method, data=data, files=files, timeout=60)
+        return response.status_code, _lowerHeaders(response.headers), response.content
+
+    def request(self, method: str, data: Dict[str, str], files: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Slack APIを呼び出す（429は`Retry-After`だけ、5xxと通信エラーとJSONでない応答は指数的に待ってリトライする）
+            :param method: APIのメソッド名 (e.g. `chat.postMessage`)
+            :return: APIのレスポンス
+        """
+        data = dict(data, token=self.token)
+        for attempt in range(MAX_RETRY):
+            try:
+                status, headers, body = self._send(method, data, files)
+            except OSError as e:
+                status, headers, body = 0, {}, str(e).encode('utf-8')
+            if status == 429:
+                try:
+                    wait = float(headers.get('retry-after', 2 ** attempt))
+                except ValueError:
+                    wait = 2 ** attempt
+                logger.warning('rate limited by slack, retry after %.1f s' % wait)
+            elif status == 0 or status >= 500:
+                wait = 2 ** attempt
+                logger.warning('slack api error (%d), retry after %.1f s' % (status, wait))
+            else:
+                try:
+                    result = json.loads(body.decode('utf-8'))
+                except ValueError:
+                    # ロードバランサーなどが返したHTMLのエラーページ
+                    wait = 2 ** attempt
+                    logger.warning('slack api returned non-json response (%d), retry after %.1f s' % (status, wait))
+                else:
+                    if not result.get('ok'):
+                        raise SlackError(method + ': ' + str(result.get('error')))
+                    return result
+            if files is not None:
+                # 読み込み途中のファイルは先頭から送り直す
+                for f in files.values():
+                    if hasattr(f[1], 'seek'):
+                        f[1].seek(0)
+            time.sleep(wait)
+        raise SlackError(method + ': gave up after %d retries' % MAX_RETRY)
 
     def post(self, text: str) -> None:
-        requests.post(
-            'https://slack.com/api/chat.postMessage', {
-                'token': self.token,
-                'channel': self.channel,
-                'text': text,
-            }
-        )
+        self.request('chat.postMessage', {
+            'channel': self.channel,
+            'text': text,
+        })
 
     def postImage(self,
                   name: str,
                   title: str,
                   image_url: str = None,
                   image: Any = None) -> None:
+        from PIL import Image
         if image is not None and type(image) == Image.Image:
-            image_io = io.BytesIO()
-            image.save(image_io, format='png')
-            image = image_io.getvalue()
+            encoded = encodeImageUnderBudget(
+                image,
+                self.image_size_budget,
+                None if self.image_format == 'auto' else [self.image_format])
+            logger.info('upload %s image : %d bytes (encoded in %.3f s)' % (
+                encoded.format, encoded.size, encoded.elapsed))
+            metrics.count('bytes_uploaded', encoded.size)
+            with encoded.file:
+                self._postFile(os.path.splitext(name)[0] + '.' + encoded.extension, title,
+                               encoded.file, encoded.mimetype)
         elif image_url is not None:
-            image = open(image_url, 'rb')
-        requests.post(
-            'https://slack.com/api/files.upload',
-            data={
-                'token': self.token,
+            with open(image_url, 'rb') as fh:
+                self._postFile(name, title, fh)
+        else:
+            self._postFile(name, title, image)
+
+    def _postFile(self, name: str, title: str, file: Any, mimetype: str = 'image/png') -> None:
+        self.request(
+            'files.upload',
+            {
                 'channels': self.channel,
                 'title': title,
             },
             files={
-                'file': (name, image, 'image/png'),
+                'file': (name, file, mimetype),
             }
         )
 
     def setReminder(self, date: datetime, comment: str) -> None:
+        import util
         util.setReminder(date, 'cd ' + os.getcwd() + ' && python3 sendMessage.py "' + comment
                          + '" >> log/slack.log 2>&1')
+
+
+class AsyncSlack(Slack):
+    """
+    常駐プロセス（`scheduler.py`）から使う非同期のSlackクライアント
+
+    全ての投稿をトークンバケットで間引き、同じ分に予定されたメッセージは1つにまとめて投稿する。
+    """
+
+    def __init__(self,
+                 channel: str,
+                 token: str,
+                 rate: float = 1.0,
+                 burst: float = 3,
+                 coalesce_delay: float = 2.0,
+                 **kwargs: Any
+                 ) -> None:
+        super().__init__(channel, token, **kwargs)
+        self.bucket = TokenBucket(rate, burst)
+        self.coalesce_delay = coalesce_delay
+        self._batches: Dict[str, List[Tuple[str, Any]]] = {}
+
+    async def _call(self, f: Any, *args: Any) -> Any:
+        import asyncio
+        await asyncio.sleep(self.bucket.reserve())
+        return await asyncio.get_event_loop().run_in_executor(None, functools.partial(f, *args))
+
+    async def postAsync(self, text: str) -> None:
+        await self._call(self.post, text)
+
+    async def postImageAsync(self, name: str, title: str, image_url: str = None, image: Any = None) -> None:
+        await self._call(self.postImage, name, title, image_url, image)
+
+    async def postCoalesced(self, text: str, date: Optional[datetime] = None) -> None:
+        """
+        `date`と同じ分に予定されたメッセージとまとめて投稿する（投稿が終わるまで待つ）
+            :param text: メッセージ
+            :param date: 予定されていた時刻（省略した場合は現在時刻）
+        """
+        import asyncio
+        key = (date or datetime.now()).strftime('%Y%m%d%H%M')
+        future = asyncio.get_event_loop().create_future()
+        if key not in self._batches:
+            self._batches[key] = []
+            asyncio.get_event_loop().call_later(
+                self.coalesce_delay, lambda: asyncio.ensure_future(self._flush(key)))
+        self._batches[key].append((text, future))
+        await future
+
+    async def _flush(self, key: str) -> None:
+        batch = self._batches.pop(key, [])
+        if not batch:
+            return
+        # 同じ文面のメッセージは1回だけ投稿する
+        text_list: List[str] = []
+        for text, _ in batch:
+            if text not in text_list:
+                text_list.append(text)
+        try:
+            await self.postAsync('\n'.join(text_list))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+        else:
+            for _, future in batch:
+                future.set_result(None)
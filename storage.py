@@ -0,0 +1,312 @@
+import os
+import json
+import hashlib
+import pickle
+import sqlite3
+import logging
+import datetime as dt
+import pandas as pd
+from typing import Any, Dict, List, Optional, Tuple
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CONTEST_COLUMNS = ['id', 'date', 'title', 'link', 'time', 'finish_date', 'is_rating', 'rating_limit']
+# コンテストの状態（`upcoming`: 登録済みでリマインダーは未登録、`planned`: リマインダー登録済み、`cancelled`: 中止）
+CONTEST_STATUS_LIST = ['upcoming', 'planned', 'cancelled']
+USER_COLUMNS = ['name', 'color', 'rating', 'count', 'rank']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS contest (
+    id TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    title TEXT NOT NULL,
+    link TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    finish_date TEXT NOT NULL,
+    is_rating INTEGER NOT NULL,
+    rating_limit INTEGER NOT NULL,
+    registered_at TEXT NOT NULL,
+    digest TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'planned'
+);
+CREATE INDEX IF NOT EXISTS contest_title ON contest (title);
+CREATE INDEX IF NOT EXISTS contest_finish_date ON contest (finish_date);
+
+CREATE TABLE IF NOT EXISTS user_snapshot (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    taken_at TEXT NOT NULL,
+    team TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS user_snapshot_team ON user_snapshot (team, id);
+CREATE TABLE IF NOT EXISTS user_status (
+    snapshot_id INTEGER NOT NULL REFERENCES user_snapshot (id),
+    name TEXT NOT NULL,
+    color TEXT,
+    rating INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    PRIMARY KEY (snapshot_id, name)
+);
+CREATE INDEX IF NOT EXISTS user_status_name ON user_status (name, snapshot_id);
+
+CREATE TABLE IF NOT EXISTS standings (
+    contest_id TEXT NOT NULL,
+    team TEXT NOT NULL DEFAULT '',
+    name TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    global_rank INTEGER NOT NULL,
+    score TEXT,
+    is_join INTEGER NOT NULL,
+    points TEXT NOT NULL,
+    PRIMARY KEY (contest_id, team, name)
+);
+CREATE INDEX IF NOT EXISTS standings_name ON standings (name);
+
+CREATE TABLE IF NOT EXISTS job (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_at TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_status_run_at ON job (status, run_at);
+
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+
+def contestDigest(contest: Any) -> str:
+    """
+    コンテストのリマインダーに関わる項目（開始時刻・名前・時間・レート対象）のハッシュ
+        :param contest: コンテスト（`CONTEST_COLUMNS`の行）
+    """
+    return hashlib.sha1(json.dumps([
+        pd.Timestamp(contest['date']).isoformat(), contest['title'], contest['link'],
+        int(pd.Timedelta(contest['time']).total_seconds()), bool(contest['is_rating']), int(contest['rating_limit']),
+    ], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class Storage():
+    """
+    コンテスト・ユーザー・コンテスト結果を保存するSQLiteのDB
+
+    書き込みは全て追記（もしくは同じキーの上書き）なので、履歴が増えても読み書きの量は変わらない。
+    `check.py`と`generate.py`が同時に動いても壊れないようにWALモードで開く。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA busy_timeout=30000')
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    # コンテスト
+
+    def _toContestList(self, row_list: List[Any]) -> pd.DataFrame:
+        contest_list = pd.DataFrame(row_list, columns=CONTEST_COLUMNS)
+        contest_list['date'] = pd.to_datetime(contest_list['date'])
+        contest_list['time'] = pd.to_timedelta(contest_list['time'], unit='s')
+        contest_list['finish_date'] = pd.to_datetime(contest_list['finish_date'])
+        contest_list['is_rating'] = contest_list['is_rating'].astype(bool)
+        return contest_list
+
+    def readContestList(self) -> pd.DataFrame:
+        return self._toContestList(self.conn.execute(
+            'SELECT ' + ','.join(CONTEST_COLUMNS) + ' FROM contest ORDER BY date').fetchall())
+
+    def findContestList(self, id_list: List[str]) -> pd.DataFrame:
+        """`id_list`の順番でコンテストを返す（DBに無いコンテストは含まれない）"""
+        row_list = self.conn.execute(
+            'SELECT ' + ','.join(CONTEST_COLUMNS) + ' FROM contest WHERE id IN (' + ','.join('?' * len(id_list)) + ')',
+            id_list).fetchall()
+        order = {contest_id: i for i, contest_id in enumerate(id_list)}
+        return self._toContestList(sorted(row_list, key=lambda row: order[row[0]]))
+
+    def findContestByTitle(self, title: str) -> pd.DataFrame:
+        return self._toContestList(self.conn.execute(
+            'SELECT ' + ','.join(CONTEST_COLUMNS) + ' FROM contest WHERE title = ?', (title,)).fetchall())
+
+    def _contestRowList(self, contest_list: pd.DataFrame, status: str) -> List[Tuple[Any, ...]]:
+        registered_at = dt.datetime.now().isoformat()
+        return [
+            (c['id'], pd.Timestamp(c['date']).isoformat(), c['title'], c['link'],
+             int(pd.Timedelta(c['time']).total_seconds()), pd.Timestamp(c['finish_date']).isoformat(),
+             int(bool(c['is_rating'])), int(c['rating_limit']), registered_at, contestDigest(c), status)
+            for i, c in contest_list.iterrows()
+        ]
+
+    def appendContestList(self, contest_list: pd.DataFrame, status: str = 'planned') -> None:
+        """コンテストを登録する（登録済みのコンテストはそのまま）"""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO contest (' + ','.join(CONTEST_COLUMNS) + ', registered_at, digest, status) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                self._contestRowList(contest_list, status))
+
+    def upsertContestList(self, contest_list: pd.DataFrame, status: str) -> None:
+        """コンテストを登録する（登録済みのコンテストは内容と状態を上書きする）"""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO contest (' + ','.join(CONTEST_COLUMNS) + ', registered_at, digest, status) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET ' +
+                ', '.join(c + ' = excluded.' + c for c in CONTEST_COLUMNS[1:] + ['digest', 'status']),
+                self._contestRowList(contest_list, status))
+
+    def readContestRegistry(self) -> pd.DataFrame:
+        """登録済みの全コンテストを、ハッシュ（`digest`）と状態（`status`）付きでidを添字にして返す"""
+        row_list = self.conn.execute(
+            'SELECT ' + ','.join(CONTEST_COLUMNS) + ', digest, status FROM contest ORDER BY date').fetchall()
+        registry = self._toContestList([row[:len(CONTEST_COLUMNS)] for row in row_list])
+        registry['digest'] = [row[-2] for row in row_list]
+        registry['status'] = [row[-1] for row in row_list]
+        return registry.set_index('id', drop=False)
+
+    def updateContestStatus(self, id_list: List[str], status: str) -> None:
+        with self.conn:
+            self.conn.executemany('UPDATE contest SET status = ? WHERE id = ?', [(status, i) for i in id_list])
+
+    # ユーザー
+
+    def readLatestUserList(self, team: str = '') -> pd.DataFrame:
+        """チームの最後に保存した全ユーザーデータを返す（無ければ空）"""
+        return pd.DataFrame(self.conn.execute(
+            'SELECT ' + ','.join(USER_COLUMNS) + ' FROM user_status '
+            'WHERE snapshot_id = (SELECT MAX(id) FROM user_snapshot WHERE team = ?) ORDER BY rank',
+            (team,)).fetchall(),
+            columns=USER_COLUMNS)
+
+    def readUserHistory(self, name: str) -> pd.DataFrame:
+        """ユーザーの保存済みの全データを古い順に返す"""
+        return pd.DataFrame(self.conn.execute(
+            'SELECT s.taken_at, ' + ','.join('u.' + c for c in USER_COLUMNS) + ' FROM user_status u '
+            'JOIN user_snapshot s ON s.id = u.snapshot_id WHERE u.name = ? ORDER BY u.snapshot_id',
+            (name,)).fetchall(), columns=['taken_at'] + USER_COLUMNS)
+
+    def appendUserList(self,
+                       user_list: pd.DataFrame,
+                       taken_at: Optional[dt.datetime] = None,
+                       team: str = '') -> None:
+        with self.conn:
+            snapshot_id = self.conn.execute(
+                'INSERT INTO user_snapshot (taken_at, team) VALUES (?, ?)',
+                ((taken_at or dt.datetime.now()).isoformat(), team)).lastrowid
+            self.conn.executemany(
+                'INSERT INTO user_status (snapshot_id, ' + ','.join(USER_COLUMNS) + ') VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (snapshot_id, u['name'], u['color'], int(u['rating']), int(u['count']), int(u['rank']))
+                    for i, u in user_list.iterrows()
+                ])
+
+    # コンテスト結果
+
+    def appendContestStatistics(self, contest_id: str, statistics: Dict[str, pd.DataFrame], team: str = '') -> None:
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO standings '
+                '(contest_id, team, name, rank, global_rank, score, is_join, points) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (contest_id, team, status['name'], int(status['rank']), int(status['global_rank']),
+                     str(status['score']), int(bool(status['isJoin'])),
+                     json.dumps({str(k): bool(v) for k, v in problem.items()}))
+                    for ((i, status), (j, problem)) in zip(statistics['result'].iterrows(),
+                                                           statistics['points'].iterrows())
+                ])
+
+    def readContestStatistics(self, contest_id: str, team: str = '') -> Dict[str, pd.DataFrame]:
+        row_list = self.conn.execute(
+            'SELECT rank, global_rank, name, score, is_join, points FROM standings '
+            'WHERE contest_id = ? AND team = ? ORDER BY rank, global_rank', (contest_id, team)).fetchall()
+        result = pd.DataFrame([row[:5] for row in row_list],
+                              columns=['rank', 'global_rank', 'name', 'score', 'isJoin'])
+        result['isJoin'] = result['isJoin'].astype(bool)
+        points = pd.DataFrame([json.loads(row[5]) for row in row_list], dtype=bool)
+        return {'result': result, 'points': points}
+
+    # スケジューラーのジョブ
+
+    def appendJob(self, run_at: dt.datetime, kind: str, payload: Dict[str, Any]) -> int:
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT INTO job (run_at, kind, payload, created_at) VALUES (?, ?, ?, ?)',
+                (run_at.isoformat(), kind, json.dumps(payload, ensure_ascii=False),
+                 dt.datetime.now().isoformat()))
+        return cursor.lastrowid or 0
+
+    def readPendingJobList(self) -> List[Tuple[int, dt.datetime, str, Dict[str, Any]]]:
+        """未実行のジョブを(id, 実行時刻, 種類, 引数)のリストで返す"""
+        return [
+            (job_id, pd.Timestamp(run_at).to_pydatetime(), kind, json.loads(payload))
+            for job_id, run_at, kind, payload in self.conn.execute(
+                "SELECT id, run_at, kind, payload FROM job WHERE status = 'pending' ORDER BY run_at")
+        ]
+
+    def updateJobStatus(self, job_id: int, status: str) -> None:
+        with self.conn:
+            self.conn.execute('UPDATE job SET status = ? WHERE id = ?', (status, job_id))
+
+    def readJobStatus(self, job_id: int) -> Optional[str]:
+        row = self.conn.execute('SELECT status FROM job WHERE id = ?', (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def cancelJobList(self, contest_id_list: List[str]) -> int:
+        """
+        コンテストに関する未実行のジョブ（引数の`contest_id_list`に含まれるもの）を取り消す
+            :param contest_id_list: コンテストのidのリスト
+            :return: 取り消したジョブの数
+        """
+        contest_id_set = set(contest_id_list)
+        job_id_list = [
+            job_id for job_id, run_at, kind, payload in self.readPendingJobList()
+            if contest_id_set & set(payload.get('contest_id_list', []))
+        ]
+        with self.conn:
+            self.conn.executemany("UPDATE job SET status = 'cancelled' WHERE id = ?", [(i,) for i in job_id_list])
+        return len(job_id_list)
+
+    # 実行をまたいで残しておく値
+
+    def readState(self, key: str) -> Optional[str]:
+        row = self.conn.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def writeState(self, key: str, value: str) -> None:
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, value))
+
+    # 移行
+
+    def isEmpty(self) -> bool:
+        return self.conn.execute(
+            'SELECT (SELECT COUNT(*) FROM contest) + (SELECT COUNT(*) FROM user_snapshot)').fetchone()[0] == 0
+
+    def migrateFromPickle(self, contest_list_path: str, user_list_path: str) -> None:
+        """以前の`contest_list.pickle`・`user_list.pickle`を取り込む（DBが空のときだけ）"""
+        if not self.isEmpty():
+            return
+        if os.path.exists(contest_list_path):
+            logger.info('migrate ' + contest_list_path)
+            with open(contest_list_path, 'rb') as fh:
+                self.appendContestList(pickle.load(fh))
+        if os.path.exists(user_list_path):
+            logger.info('migrate ' + user_list_path)
+            with open(user_list_path, 'rb') as fh:
+                self.appendUserList(
+                    pickle.load(fh),
+                    dt.datetime.fromtimestamp(os.path.getmtime(user_list_path)))
+
+
+def openStorage(data_path: str) -> Storage:
+    """`data_path`のDBを開き、古いpickleがあれば取り込む"""
+    storage = Storage(os.path.join(data_path, 'atcoder.sqlite3'))
+    storage.migrateFromPickle(os.path.join(data_path, 'contest_list.pickle'),
+                              os.path.join(data_path, 'user_list.pickle'))
+    return storage
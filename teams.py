@@ -0,0 +1,80 @@
+import configparser
+from typing import Any, Dict, List, NamedTuple
+
+import slack
+
+# `[team:(チーム名)]`のセクションがチームの設定
+TEAM_SECTION_PREFIX = 'team:'
+
+
+class Team(NamedTuple):
+    """結果を投稿するチーム（所属とSlackのチャンネルの組）"""
+    name: str  # `[atcoder]`・`[slack]`だけで設定した場合は空文字列
+    affiliation: str
+    channel_name: str
+    test_channel_name: str
+
+    def channel(self, mode: str) -> str:
+        return self.channel_name if mode == 'deployment' else self.test_channel_name
+
+    def label(self) -> str:
+        return self.name or self.affiliation
+
+
+def readTeamList(config: configparser.ConfigParser) -> List[Team]:
+    """
+    設定ファイルから全チームを読み込む
+
+    `[team:(チーム名)]`が無い場合は`[atcoder] affiliation`と`[slack] channel_name`の1チームだけにする。
+        :param config: 設定ファイル
+        :return: チームのリスト
+    """
+    team_list = [
+        Team(
+            name=section[len(TEAM_SECTION_PREFIX):],
+            affiliation=config[section]['affiliation'],
+            channel_name=config[section]['channel_name'],
+            test_channel_name=config.get(section, 'test_channel_name',
+                                         fallback=config.get('slack', 'test_channel_name', fallback='')),
+        )
+        for section in config.sections() if section.startswith(TEAM_SECTION_PREFIX)
+    ]
+    if team_list:
+        return team_list
+    return [Team(
+        name='',
+        affiliation=config.get('atcoder', 'affiliation', fallback=''),
+        channel_name=config['slack']['channel_name'],
+        test_channel_name=config.get('slack', 'test_channel_name', fallback=''),
+    )]
+
+
+def openSlack(config: configparser.ConfigParser, channel: str, cls: Any = slack.Slack, **kwargs: Any) -> Any:
+    """`[slack]`の設定で`channel`に投稿するクライアントを作る"""
+    return cls(
+        channel=channel,
+        token=config['slack']['token'],
+        api_url=config.get('slack', 'api_url', fallback=slack.SLACK_API_URL),
+        image_format=config.get('slack', 'image_format', fallback='auto'),
+        image_size_budget=config.getint('slack', 'image_size_budget', fallback=1024 * 1024),
+        **kwargs
+    )
+
+
+def openSlackDict(config: configparser.ConfigParser, mode: str = 'deployment',
+                  cls: Any = slack.Slack, **kwargs: Any) -> Dict[str, Any]:
+    """全チームのクライアントをチーム名ごとに作る（同じチャンネルのチームは同じクライアントを使う）"""
+    slack_of_channel: Dict[str, Any] = {}
+    slack_dict = {}
+    for team in readTeamList(config):
+        channel = team.channel(mode)
+        if channel not in slack_of_channel:
+            slack_of_channel[channel] = openSlack(config, channel, cls, **kwargs)
+        slack_dict[team.name] = slack_of_channel[channel]
+    return slack_dict
+
+
+def openSlackList(config: configparser.ConfigParser, mode: str = 'deployment',
+                  cls: Any = slack.Slack, **kwargs: Any) -> List[Any]:
+    """全チームのチャンネルのクライアントを重複なしで作る"""
+    return list({id(s): s for s in openSlackDict(config, mode, cls, **kwargs).values()}.values())
@@ -2,56 +2,190 @@ import os
 import time
 import io
 import random
-import pandas as pd
+import hashlib
 import datetime
 import requests
+import requests.adapters
+import urllib.parse
 import logging
 import subprocess
-from selenium import webdriver
-from webdriver_manager import chrome
-from IPython import embed
-from collections import namedtuple
-import lxml.html
-from typing import Optional, Any, Union, List, Callable
-from PIL import Image
+import threading
+import contextlib
+import atexit
+import metrics
+import archive
+import httpcache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib3.util.retry import Retry
+from typing import Optional, Any, Union, List, Callable, Dict, Iterator, NamedTuple, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from PIL import Image
+
+# リマインダーの投稿（`sendMessage.py`）はこのモジュールを読み込むだけなので、
+# selenium・lxml・PILのような重いモジュールは使う関数の中で読み込む
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-def fullpage_screenshot(driver: Any) -> Image.Image:
-    page_width = driver.execute_script("return document.body.offsetWidth")
-    page_height = driver.execute_script("return document.body.parentNode.scrollHeight")
-    view_width = driver.execute_script("return document.body.clientWidth")
-    view_height = driver.execute_script("return window.innerHeight")
+# 画像の範囲（PILの`crop`と同じ (左, 上, 右, 下)）
+Region = Tuple[int, int, int, int]
+
+
+def capture_screenshot(driver: Any, region: Optional[Region] = None) -> bytes:
+    """
+    ページ全体（`region`を指定した場合はその範囲）のスクリーンショットをPNGのバイト列で返す
+
+    DevToolsの`Page.captureScreenshot`が使えればビューポートの外まで一度に撮り、
+    使えない場合はウィンドウをページの大きさに広げてから撮る（どちらもスクロールや一時ファイルは使わない）。
+        :param driver: WebDriver
+        :param region: 撮影する範囲
+    """
+    import base64
+    from selenium.common.exceptions import WebDriverException
+
+    page_width, page_height = driver.execute_script(
+        "return [document.documentElement.scrollWidth, document.documentElement.scrollHeight]")
+    left, top, right, bottom = region or (0, 0, page_width, page_height)
+    right, bottom = min(right, page_width), min(bottom, page_height)
+
+    if hasattr(driver, 'execute_cdp_cmd'):
+        try:
+            result = driver.execute_cdp_cmd('Page.captureScreenshot', {
+                'format': 'png',
+                'captureBeyondViewport': True,
+                'clip': {'x': left, 'y': top, 'width': right - left, 'height': bottom - top, 'scale': 1},
+            })
+            return base64.b64decode(result['data'])
+        except WebDriverException:
+            logger.info('Page.captureScreenshot is not available, resize window instead')
+
+    from PIL import Image
+    # headlessなのでウィンドウの大きさとビューポートの大きさは一致する
+    window = driver.get_window_size()
+    driver.set_window_size(max(window['width'], right), max(window['height'], bottom))
+    try:
+        png = driver.get_screenshot_as_png()
+    finally:
+        driver.set_window_size(window['width'], window['height'])
+    image = Image.open(io.BytesIO(png))
+    if image.size == (right - left, bottom - top):
+        return png
+    output = io.BytesIO()
+    image.crop((left, top, right, bottom)).save(output, format='png')
+    return output.getvalue()
+
+
+def fullpage_screenshot(driver: Any, region: Optional[Region] = None) -> 'Image.Image':
+    from PIL import Image
+    image = Image.open(io.BytesIO(capture_screenshot(driver, region)))
+    image.load()
+    return image.convert('RGB')
+
+
+class BrowserPool():
+    """起動済みのheadless Chromeを使い回すためのプール
+
+    Chromeの起動は一回の実行で最も重い処理なので、一度起動したブラウザはプールに戻して再利用する。
+    同時に起動するブラウザは`size`個まで、`max_pages`ページ開いたブラウザはメモリリーク対策で作り直す。
+    """
 
-    Point = namedtuple('Point', ['x', 'y'])
-    view_list = []
-    for x in range(0, page_width, view_width):
-        for y in range(0, page_height, view_height):
-            view_list.append(Point(x, y))
+    def __init__(self, size: int = 2, max_pages: int = 50) -> None:
+        self.size = size
+        self.max_pages = max_pages
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle: List[Any] = []
+        self._pages: Dict[int, int] = {}
+        self._driver_path: Optional[str] = None
 
-    page_image = Image.new('RGB', (page_width, page_height))
+    def _launch(self, width: int, height: int) -> Any:
+        from selenium import webdriver
+        from webdriver_manager import chrome
+        if self._driver_path is None:
+            self._driver_path = chrome.ChromeDriverManager('2.41').install()
+        options = webdriver.chrome.options.Options()
+        options.add_argument('--headless')
+        options.add_argument('--window-size=' + str(width) + ',' + str(height))
+        options.add_argument('--no-sandbox')
+        logger.info('launch new browser')
+        metrics.count('browser_launches')
+        driver = webdriver.Chrome(executable_path=self._driver_path, chrome_options=options)
+        self._pages[id(driver)] = 0
+        return driver
 
-    fn = 'tmp/' + str(random.random())
+    def _discard(self, driver: Any) -> None:
+        from selenium.common.exceptions import WebDriverException
+        self._pages.pop(id(driver), None)
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
 
-    for count, view in enumerate(view_list):
-        driver.execute_script("window.scrollTo({0}, {1})".format(view.x, view.y))
-        time.sleep(0.2)
+    def _isAlive(self, driver: Any) -> bool:
+        from selenium.common.exceptions import WebDriverException
+        try:
+            return driver.execute_script('return 1') == 1
+        except WebDriverException:
+            return False
 
-        file_name = fn + "part_{0}.png".format(count)
-        driver.get_screenshot_as_file(file_name)
-        screenshot = Image.open(file_name)
+    def checkout(self, width: int = 1280, height: int = 1024) -> Any:
+        self._slots.acquire()
+        try:
+            with self._lock:
+                driver = self._idle.pop() if self._idle else None
+            if driver is not None and not self._isAlive(driver):
+                logger.info('browser is not responding, relaunch')
+                self._discard(driver)
+                driver = None
+            if driver is None:
+                return self._launch(width, height)
+            driver.set_window_size(width, height)
+            return driver
+        except BaseException:
+            self._slots.release()
+            raise
 
-        offset = (
-            view.x if view.x <= page_width - view_width else page_width - view_width,
-            view.y if view.y <= page_height - view_height else page_height - view_height,
-        )
+    def checkin(self, driver: Any, broken: bool = False) -> None:
+        from selenium.common.exceptions import WebDriverException
+        try:
+            self._pages[id(driver)] = self._pages.get(id(driver), 0) + 1
+            if broken or self._pages[id(driver)] >= self.max_pages:
+                self._discard(driver)
+                return
+            try:
+                driver.delete_all_cookies()
+                driver.get('about:blank')
+            except WebDriverException:
+                self._discard(driver)
+                return
+            with self._lock:
+                self._idle.append(driver)
+        finally:
+            self._slots.release()
 
-        page_image.paste(screenshot, offset)
+    @contextlib.contextmanager
+    def browser(self, width: int = 1280, height: int = 1024) -> Iterator[Any]:
+        from selenium.common.exceptions import WebDriverException
+        driver = self.checkout(width, height)
+        broken = False
+        try:
+            yield driver
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.checkin(driver, broken)
 
-        del screenshot
-        os.remove(file_name)
-    return page_image
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for driver in idle:
+            self._discard(driver)
+
+
+browser_pool = BrowserPool()
+atexit.register(browser_pool.close)
 
 
 def operateBrowser(url: str = None,
@@ -59,67 +193,247 @@ def operateBrowser(url: str = None,
                    op: Callable[[Any], None] = None,
                    return_screenshot: bool = False,
                    width: int = 1280,
-                   height: int = 1024) -> Union[Image.Image, str]:
-    options = webdriver.chrome.options.Options()
-    options.add_argument('--headless')
-    options.add_argument('--window-size=' + str(width) + ',' + str(height))
-    options.add_argument('--no-sandbox')
-    driver = webdriver.Chrome(executable_path=chrome.ChromeDriverManager('2.41').install(), chrome_options=options)
+                   height: int = 1024,
+                   region: Optional[Region] = None) -> Union['Image.Image', str]:
     if page is not None:
         fn = 'tmp/' + str(random.random()) + '.html'
         with io.open(fn, 'w', encoding='utf-8') as fh:
             fh.write(page)
         url = 'file://' + os.getcwd() + '/' + fn
-    try:
+    metrics.count('pages_rendered')
+    with metrics.span('browser'), browser_pool.browser(width, height) as driver:
         driver.get(url)
         if op is not None:
             op(driver)
         if return_screenshot:
-            return fullpage_screenshot(driver)
+            return fullpage_screenshot(driver, region)
         page = driver.page_source
-    finally:
-        driver.quit()
     return page
 
 
+class RateLimiter():
+    """ホストごとにリクエストの間隔を`interval`秒以上空ける"""
+
+    def __init__(self, interval: float = 0.2) -> None:
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next: Dict[str, float] = {}
+
+    def wait(self, url: str) -> None:
+        host = urllib.parse.urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next.get(host, now))
+            self._next[host] = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+# AtCoderのURL（オフラインのベンチマークではローカルのサーバーに差し替える）
+ATCODER_URL = 'https://beta.atcoder.jp'
+
+# 全リクエストで同じコネクションプールを使い回す
+FETCH_CONCURRENCY = 8
+session = requests.Session()
+for scheme in ['http://', 'https://']:
+    session.mount(scheme, requests.adapters.HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=FETCH_CONCURRENCY,
+        max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504]),
+    ))
+rate_limiter = RateLimiter()
+# 取得したページのデバッグ用の保存先とレスポンスのキャッシュ（`generate.py`・`check.py`で設定ファイルから作り直す）
+page_archive = archive.PageArchive()
+response_cache = httpcache.ResponseCache()
+
+
+def fetchResponse(url: str, refresh: bool = False) -> httpcache.CachedResponse:
+    """
+    `response_cache`を通してページを取得する
+        :param url: 取得するURL
+        :param refresh: キャッシュが新しくてもサーバーに問い合わせる（変わっていなければ304で済ませる）
+        :return: レスポンス
+    """
+    cached = response_cache.get(url)
+    if cached is not None and not refresh and response_cache.isFresh(cached):
+        metrics.count('http_cache_hits')
+        return cached
+    headers = {}
+    if cached is not None and cached.etag is not None:
+        headers['If-None-Match'] = cached.etag
+    if cached is not None and cached.last_modified is not None:
+        headers['If-Modified-Since'] = cached.last_modified
+    rate_limiter.wait(url)
+    response = session.get(url, headers=headers, timeout=30)
+    metrics.count('http_requests')
+    metrics.count('bytes_downloaded', len(response.content))
+    if response.status_code == 304 and cached is not None:
+        metrics.count('http_not_modified')
+        cached = cached._replace(fetched_at=time.time())
+        response_cache.put(cached)
+        return cached
+    response.raise_for_status()
+    entry = httpcache.makeCachedResponse(url, response)
+    if entry is None:
+        # `no-store`なのでキャッシュしない
+        return httpcache.CachedResponse(url, response.text, hashlib.sha1(response.content).hexdigest(),
+                                        None, None, time.time(), 0)
+    response_cache.put(entry)
+    return entry
+
+
+def fetch(url: str, refresh: bool = False) -> str:
+    return fetchResponse(url, refresh).text
+
+
+def fetchAll(url_list: List[str], concurrency: int = FETCH_CONCURRENCY, refresh: bool = False) -> List[str]:
+    """
+    複数のページを並列に取得する
+        :param url_list: 取得するURLのリスト
+        :param concurrency: 同時に取得するページ数の上限
+        :param refresh: キャッシュが新しくてもサーバーに問い合わせる
+        :return: `url_list`と同じ順番のページのリスト
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(url_list))),
+                            initializer=metrics.attach, initargs=(metrics.current(),)) as executor:
+        return list(executor.map(lambda url: fetch(url, refresh), url_list))
+
+
+class PageWatcher():
+    """
+    同じページを繰り返し取得し、前回から変わったときだけ中身を返す
+
+    毎回サーバーに問い合わせ（ETag/Last-Modifiedがあれば条件付きリクエストで304を受け取る）、本文のハッシュで比較する。
+    """
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.digest: Optional[str] = None
+
+    def poll(self) -> Optional[str]:
+        response = fetchResponse(self.url, refresh=True)
+        if response.digest == self.digest:
+            return None
+        self.digest = response.digest
+        return response.text
+
+
 def scrape(url: str, *xpath_list: Union[str, List[str]]) -> Union[str, List[str]]:
-    page = requests.get(url).text
+    return parseXpath(fetch(url), *xpath_list)
+
+
+def scrapeAll(url_list: List[str], *xpath_list: Union[str, List[str]],
+              refresh: bool = False) -> List[Union[str, List[str]]]:
+    return [parseXpath(page, *xpath_list) for page in fetchAll(url_list, refresh=refresh)]
+
+
+def parseXpath(page: str, *xpath_list: Union[str, List[str]]) -> Union[str, List[str]]:
+    import lxml.html
     dom = lxml.html.fromstring(page)
     result = [dom.xpath(xpath) for xpath in xpath_list]
     return result if len(result) > 1 else result[0]
 
 
-pd.core.series.Series.splitBy = lambda self, i: self.map(lambda x: x[i])  # type: ignore
+class Cell(NamedTuple):
+    """表のセル"""
+    texts: List[str]  # 空白を除いたテキストノードのリスト
+    href: Optional[str]  # 最初のリンク先
+    link_text: Optional[str]  # 最初のリンクのテキスト
+    classes: List[str]  # セル内の要素に付いているCSSクラス
+
+
+class Table(NamedTuple):
+    """ページ内の表"""
+    header: List[Cell]
+    rows: List[List[Cell]]
+
+    def columns(self) -> List[str]:
+        return [' '.join(cell.texts) for cell in self.header]
+
+    def records(self) -> List[Dict[str, Cell]]:
+        columns = self.columns()
+        return [dict(zip(columns, row)) for row in self.rows]
+
+
+def parseCell(element: Any) -> Cell:
+    texts = [text.strip() for text in element.itertext() if text.strip()]
+    links = element.xpath('.//a[@href]')
+    classes = [c for e in element.iter() for c in (e.get('class') or '').split()]
+    return Cell(
+        texts=texts,
+        href=links[0].get('href') if links else None,
+        link_text=links[0].text_content().strip() if links else None,
+        classes=classes,
+    )
+
+
+def parseTables(page: str) -> List[Table]:
+    """
+    ページ内の全ての表を取り出す
+        :param page: html
+        :return: 表のリスト（ヘッダーは`thead`、無ければ最初の行）
+    """
+    # `tfoot`がソース上で`tbody`より前にあってもブラウザと同じく最後に並べる
+    section_order = {'thead': 0, 'tbody': 1, 'table': 1, 'tfoot': 2}
+    import lxml.html
+    dom = lxml.html.fromstring(page)
+    table_list = []
+    for table in dom.iter('table'):
+        # 入れ子になった表の行は含めない
+        row_list = [
+            [parseCell(cell) for cell in row if cell.tag in ('td', 'th')]
+            for row in sorted(
+                (row for row in table.iter('tr')
+                 if row.getparent() is table or row.getparent().getparent() is table),
+                key=lambda row: section_order.get(row.getparent().tag, 1))
+        ]
+        if not row_list:
+            continue
+        table_list.append(Table(header=row_list[0], rows=row_list[1:]))
+    return table_list
+
+
+# 同じページを何度もパースしないように、最近パースした表を本文のハッシュごとに残しておく
+PARSED_TABLE_CACHE_SIZE = 8
+_parsed_table_cache: 'OrderedDict[str, List[Table]]' = OrderedDict()
+_parsed_table_lock = threading.Lock()
+
+
+def parseTablesCached(page: str) -> List[Table]:
+    digest = hashlib.sha1(page.encode('utf-8')).hexdigest()
+    with _parsed_table_lock:
+        if digest in _parsed_table_cache:
+            _parsed_table_cache.move_to_end(digest)
+            return _parsed_table_cache[digest]
+    table_list = parseTables(page)
+    with _parsed_table_lock:
+        _parsed_table_cache[digest] = table_list
+        while len(_parsed_table_cache) > PARSED_TABLE_CACHE_SIZE:
+            _parsed_table_cache.popitem(last=False)
+    return table_list
 
 
 def scrapeTable(
         url: str = None,
         page: str = None,
         op: Callable[[Any], None] = None,
-        tableOp: Callable[[Any], Optional[str]] = None) -> pd.DataFrame:
+        refresh: bool = False) -> List[Table]:
+    """
+    ページ内の全ての表を取り出す
+        :param url: ページのURL
+        :param page: 取得済みのページ（省略した場合は`url`を取得する）
+        :param op: ブラウザで開いてから実行する操作（指定した場合はブラウザで取得する）
+        :param refresh: キャッシュが新しくてもサーバーに問い合わせる
+    """
     if page is None and url:
         if op is None:
-            page = requests.get(url).text
+            page = fetch(url, refresh)
         else:
             page = operateBrowser(url=url, op=op)
 
-    with open("log/" + str(datetime.datetime.now()).replace(" ", "_") + ".html", mode='w') as f:
-        f.write(page)
-
-    # `pd.read_html(htmlからtableを取ってくる関数)`でテーブル上のセルに対して任意のオペレーションを掛けられるようにする
-    def _extend_text_getter(self: Any, obj: Any) -> str:
-        if tableOp is not None:
-            res = tableOp(obj)
-            if res is not None:
-                return res
-        text = obj.get_text(separator=',', strip=True)
-        return text if obj.name == 'th' or obj.a is None else ','.join([obj.a.get('href'), text])
-
-    pd.io.html._BeautifulSoupHtml5LibFrameParser._text_getter = _extend_text_getter
+    page_archive.save(url or 'about:blank', page)
 
-    raw_data = pd.read_html(page, flavor='bs4')
-    data = [table.applymap(lambda x: (str)(x).split(',')) for table in raw_data]
-    return data
+    return parseTablesCached(page)
 
 
 def setReminder(date: datetime.datetime, command: str) -> None:
@@ -132,14 +446,16 @@ def setReminder(date: datetime.datetime, command: str) -> None:
     logger.info('set new reminder : at %s <<< \'%s\'' % (date_s, command))
 
 
-def concat_images_vertical(im1: Image.Image, im2: Image.Image) -> Image.Image:
+def concat_images_vertical(im1: 'Image.Image', im2: 'Image.Image') -> 'Image.Image':
+    from PIL import Image
     dst = Image.new('RGB', (max(im1.width, im2.width), (im1.height + im2.height)), (255, 255, 255))
     dst.paste(im1, (0, 0))
     dst.paste(im2, (0, im1.height))
     return dst
 
 
-def concat_images_horizontal(im1: Image.Image, im2: Image.Image) -> Image.Image:
+def concat_images_horizontal(im1: 'Image.Image', im2: 'Image.Image') -> 'Image.Image':
+    from PIL import Image
     dst = Image.new('RGB', ((im1.width + im2.width), max(im1.height, im2.height)), (255, 255, 255))
     dst.paste(im1, (0, 0))
     dst.paste(im2, (im1.width, 0))
@@ -0,0 +1,82 @@
+import pandas as pd
+from typing import Dict, List, Optional
+
+
+class ResultRow():
+    """コンテスト結果の表の1行（ユーザーの色を結合済み）"""
+    __slots__ = ('rank', 'global_rank', 'name', 'color', 'score', 'points')
+
+    def __init__(self, rank: int, global_rank: int, name: str, color: Optional[str], score: str,
+                 points: List[bool]) -> None:
+        self.rank = rank
+        self.global_rank = global_rank
+        self.name = name
+        self.color = color  # 全ユーザーデータに居ない場合はNone
+        self.score = score
+        self.points = points
+
+
+class ResultTable():
+    """1コンテスト分のコンテスト結果の表"""
+    __slots__ = ('title', 'problem_list', 'row_list')
+
+    def __init__(self, title: str, problem_list: List[str], row_list: List[ResultRow]) -> None:
+        self.title = title
+        self.problem_list = problem_list
+        self.row_list = row_list
+
+
+class RatingRow():
+    """レーティングの表の1行"""
+    __slots__ = ('rank', 'name', 'color', 'rating', 'rank_diff', 'rating_diff')
+
+    def __init__(self, rank: int, name: str, color: str, rating: int, rank_diff: int, rating_diff: int) -> None:
+        self.rank = rank
+        self.name = name
+        self.color = color
+        self.rating = rating
+        self.rank_diff = rank_diff
+        self.rating_diff = rating_diff
+
+
+def buildResultTableList(contest_list: pd.DataFrame,
+                         contest_statistics_list: List[Dict[str, pd.DataFrame]],
+                         user_list: pd.DataFrame) -> List[ResultTable]:
+    """
+    コンテスト結果の表の中身を作る（`tpl/result.tpl.html`と`render.renderResult`で使う）
+
+    ユーザーの色は名前の辞書で一度に結合するので、参加者数と全ユーザー数の和に比例する時間で終わる。
+        :param contest_list: 全コンテスト名
+        :param contest_statistics_list: 全コンテスト結果
+        :param user_list: 全ユーザーデータ
+        :return: コンテストごとの表
+    """
+    color_of = dict(zip(user_list['name'].tolist(), user_list['color'].tolist()))
+    table_list = []
+    for title, s in zip(contest_list['title'].tolist(), contest_statistics_list):
+        result, points = s['result'], s['points']
+        table_list.append(ResultTable(
+            title=str(title),
+            problem_list=[str(t) for t in points.columns],
+            row_list=[
+                ResultRow(rank, global_rank, str(name), color_of.get(name), str(score), problem)
+                for rank, global_rank, name, score, problem in zip(
+                    result['rank'].tolist(), result['global_rank'].tolist(), result['name'].tolist(),
+                    result['score'].tolist(), points.to_numpy(dtype=bool).tolist())
+            ],
+        ))
+    return table_list
+
+
+def buildRatingRowList(user_list: pd.DataFrame) -> List[RatingRow]:
+    """
+    レーティングの表の中身を作る（`tpl/rating.tpl.html`と`render.renderRating`で使う）
+        :param user_list: レーティングの差分付きの全ユーザーデータ
+        :return: 表の行
+    """
+    return [
+        RatingRow(i + 1, str(name), str(color), int(rating), int(rank_diff), int(rating_diff))
+        for i, (name, color, rating, rank_diff, rating_diff) in enumerate(zip(
+            user_list['name'].tolist(), user_list['color_current'].tolist(), user_list['rating_current'].tolist(),
+            user_list['rank_diff'].tolist(), user_list['rating_diff'].tolist()))
+    ]